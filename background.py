@@ -0,0 +1,8 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads that parse uploads while the page keeps rendering. openpyxl releases the GIL
+# only in places, but parsing off the script thread is what lets the first sections show early.
+PARSE_WORKERS = int(os.environ.get('COSTING_PARSE_WORKERS', '4'))
+
+POOL = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix='costing-parse')
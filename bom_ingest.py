@@ -0,0 +1,356 @@
+import functools
+import io
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import smt_placement
+import stage_matching
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_ROW, _CELL, _VALUE, _TEXT = (f'{_MAIN_NS}{tag}' for tag in ('row', 'c', 'v', 't'))
+
+# Rows read per chunk when streaming a BOM
+CHUNK_ROWS = 50_000
+
+# Sheet read from an .xlsx BOM when it has one by this name, else the first sheet
+BOM_SHEET = 'BOM'
+
+# How a BOM line is mounted
+SMT, TH, UNKNOWN = 'SMT', 'TH', 'unknown'
+
+# Optional BOM columns: the mount as written (SMT/SMD, TH/THT/PTH), pins per part and price per part
+MOUNT_COLUMN = 'Mount'
+PINS_COLUMN = 'Pins'
+PRICE_COLUMN = 'Unit Price'
+
+# Columns read from a BOM; any others are skipped while parsing
+BOM_COLUMNS = ['Package', 'Quantity', 'Side', 'Part Number', MOUNT_COLUMN, PINS_COLUMN, PRICE_COLUMN]
+
+# Mount codes of the lines while they are aggregated
+_SMT, _TH, _UNKNOWN = 0, 1, 2
+
+# Through-hole packages, matched at the start of their package key
+TH_PACKAGE = re.compile(
+    r'(?:[pc]?dip|sip|zip|to(?:92|126|220|247|264|3p|3|18|39|5)(?![\d.])|radial|axial|tht?$|pth|'
+    r'do(?:15|35|41|201)(?![\d.])|pga|(?:pin)?header)'
+)
+
+# Package families whose number is an outline code rather than a pin count, with their usual
+# pins; a family ending in one of these (TSOT, SSOT) counts the same
+OUTLINE_PINS = {'sot': 3, 'sod': 2, 'sc': 3, 'do': 2, 'to': 3, 'dpak': 3, 'sma': 2, 'smb': 2, 'smc': 2, 'melf': 2, 'radial': 2, 'axial': 2}
+
+# Pins of a part whose package gives no count, such as chips and body sizes
+DEFAULT_PINS = 2
+
+SIDE_COLUMNS = [
+    'Side', 'BOM Lines', 'Components', 'SMT Components', 'TH Components', 'Unknown Components',
+    'SMT Joints', 'TH Barrels', 'Solder Joints', 'SMT Placement CT (s)', 'Feeder Slots', 'Tray Parts',
+    'Electronics Component ($)',
+]
+
+
+def read_bom(data, name, chunk_rows=CHUNK_ROWS):
+    """Yield the BOM_COLUMNS of a .csv or .xlsx BOM as frames of up to ``chunk_rows`` rows.
+
+    Workbooks are streamed straight from the worksheet XML, from the BOM sheet if
+    there is one, with the first non-blank row as the header; only the cells of the
+    BOM columns are converted. A BOM without data rows yields one empty frame, so its
+    columns can still be checked.
+    """
+    if name.lower().endswith('.csv'):
+        header = pd.read_csv(io.BytesIO(data), nrows=0).columns
+        usecols = [column for column in header if column in BOM_COLUMNS]
+        yield from pd.read_csv(io.BytesIO(data), usecols=usecols, chunksize=chunk_rows)
+        return
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        try:
+            rows = _worksheet_rows(archive, _bom_sheet_path(archive), _shared_strings(archive))
+        except (KeyError, StopIteration, ET.ParseError):
+            # Non-standard package layout, let openpyxl resolve the sheet
+            rows = _openpyxl_rows(data)
+        yield from _row_chunks(rows, chunk_rows)
+
+
+def _bom_sheet_path(archive):
+    # Archive path of the BOM sheet, else of the first sheet, from the workbook manifest
+    sheets = list(ET.fromstring(archive.read('xl/workbook.xml')).iter(f'{_MAIN_NS}sheet'))
+    sheet = next((sheet for sheet in sheets if sheet.get('name') == BOM_SHEET), sheets[0])
+    relations = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    target = next(
+        relation.get('Target') for relation in relations.iter(f'{_PACKAGE_NS}Relationship')
+        if relation.get('Id') == sheet.get(f'{_RELATIONSHIP_NS}id')
+    )
+    return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+
+
+def _shared_strings(archive):
+    # Text of each shared string, rich-text runs joined
+    try:
+        root = ET.fromstring(archive.read('xl/sharedStrings.xml'))
+    except KeyError:
+        return []
+    return [
+        ''.join(text.text or '' for text in item.findall(f'{_MAIN_NS}t') + item.findall(f'{_MAIN_NS}r/{_MAIN_NS}t'))
+        for item in root.iter(f'{_MAIN_NS}si')
+    ]
+
+
+def _worksheet_rows(archive, path, strings):
+    # {column position: value} of each row with cells, like openpyxl's values_only rows
+    for _, element in ET.iterparse(archive.open(path)):
+        if element.tag != _ROW:
+            continue
+        row = {}
+        for position, cell in enumerate(element.iter(_CELL)):
+            reference = cell.get('r')
+            if reference is not None:
+                position = _column_position(reference)
+            cell_type = cell.get('t')
+            if cell_type == 'inlineStr':
+                row[position] = ''.join(text.text or '' for text in cell.iter(_TEXT))
+                continue
+            value = cell.findtext(_VALUE)
+            if value is None:
+                continue
+            if cell_type == 's':
+                row[position] = strings[int(value)]
+            elif cell_type == 'b':
+                row[position] = value == '1'
+            elif cell_type in ('str', 'e'):
+                row[position] = value
+            else:
+                row[position] = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+        element.clear()
+        yield row
+
+
+@functools.lru_cache(maxsize=None)
+def _letters_position(letters):
+    position = 0
+    for character in letters:
+        position = position * 26 + ord(character) - 64
+    return position - 1
+
+
+def _column_position(reference):
+    # 0-based column of a cell reference such as 'AB12'
+    return _letters_position(reference.rstrip('0123456789'))
+
+
+def _openpyxl_rows(data):
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        worksheet = workbook[BOM_SHEET] if BOM_SHEET in workbook.sheetnames else workbook.worksheets[0]
+        for row in worksheet.iter_rows(values_only=True):
+            yield {position: value for position, value in enumerate(row) if value is not None}
+    finally:
+        workbook.close()
+
+
+def _row_chunks(rows, chunk_rows):
+    # Frames of the BOM columns, the first non-blank row naming the columns
+    header = next((row for row in rows if row), None)
+    if header is None:
+        return
+    columns = {}
+    for position, value in sorted(header.items()):
+        if str(value) in BOM_COLUMNS and str(value) not in columns.values():
+            columns[position] = str(value)
+    positions, names = list(columns), list(columns.values())
+
+    batch, yielded = [], False
+    for row in rows:
+        batch.append([row.get(position) for position in positions])
+        if len(batch) == chunk_rows:
+            yield pd.DataFrame.from_records(batch, columns=names)
+            batch, yielded = [], True
+    if batch or not yielded:
+        yield pd.DataFrame.from_records(batch, columns=names)
+
+
+def package_pins(key):
+    # Pins of a package key: an end '-N' count, the outline default, else the family's number
+    if key is None:
+        return DEFAULT_PINS
+    count = re.search(r'-(\d+)$', key)
+    if count:
+        return int(count.group(1))
+    family, size = smt_placement.package_family(key)
+    if family in (None, 'chip', 'body'):
+        return DEFAULT_PINS
+    outline = next((pins for outline, pins in OUTLINE_PINS.items() if family.endswith(outline)), None)
+    if outline is not None:
+        return outline
+    return int(size) if size is not None and size.is_integer() and size > 0 else DEFAULT_PINS
+
+
+def mount_of(value):
+    # SMT or TH as written in a Mount column, None when it says neither
+    if not isinstance(value, str):
+        return None
+    folded = value.strip().casefold()
+    if folded.startswith(('smt', 'smd', 'surface')):
+        return SMT
+    if folded.startswith(('th', 'pth', 'through')):
+        return TH
+    return None
+
+
+class BomSummary:
+    """Per-side totals of an ingested BOM, its SMT feeders and the lines that could not be placed.
+
+    ``sides`` follows SIDE_COLUMNS; ``feeders`` is smt_placement.feeder_requirements'
+    feeder table for the SMT lines; ``unplaced`` lists the lines whose package is
+    neither through-hole nor in SMD_Package_Feeder_Master.
+    """
+
+    def __init__(self, sides, feeders, unplaced):
+        self.sides = sides
+        self.feeders = feeders
+        self.unplaced = unplaced
+
+    def nbytes(self):
+        return sum(int(frame.memory_usage(deep=True).sum()) for frame in (self.sides, self.feeders, self.unplaced))
+
+    def total(self, column):
+        return float(self.sides[column].sum())
+
+    def placement_times(self):
+        # {side: SMT Placement CT} of the sides with SMT placements, for smt_placement.apply_placement_times
+        placed = self.sides[self.sides['SMT Components'] > 0]
+        return dict(zip(placed['Side'], placed['SMT Placement CT (s)']))
+
+
+class _Packages:
+    # Catalog match, mount and pins of each distinct package, shared by the chunks of one BOM
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._known = {}
+
+    def describe(self, packages):
+        # (catalog positions, matches, mount codes, pins) arrays for a column of packages
+        codes, uniques = pd.factorize(pd.Series(packages, dtype=object))
+        described = []
+        for package in uniques:
+            if package not in self._known:
+                position, match = self.catalog.find(package)
+                key = smt_placement.package_key(package)
+                if key is not None and TH_PACKAGE.match(key):
+                    mount = _TH
+                else:
+                    mount = _SMT if position >= 0 else _UNKNOWN
+                self._known[package] = (position, match, mount, package_pins(key))
+            described.append(self._known[package])
+        # Blank packages factorize to -1, the last entry
+        described.append((-1, stage_matching.UNMATCHED, _UNKNOWN, DEFAULT_PINS))
+        positions, matches, mounts, pins = zip(*described)
+        return (
+            np.array(positions, dtype=np.intp)[codes], np.array(matches, dtype=object)[codes],
+            np.array(mounts, dtype=np.int8)[codes], np.array(pins, dtype=np.float64)[codes],
+        )
+
+
+def _chunk_lines(chunk, packages):
+    # One chunk's lines with pins and price, and their mount codes, all worked out on whole columns
+    positions, matches, mount, pins = packages.describe(chunk['Package'])
+    lines = smt_placement.bom_lines(chunk, packages.catalog, (positions, matches))
+    if MOUNT_COLUMN in chunk.columns:
+        codes, uniques = pd.factorize(chunk[MOUNT_COLUMN].astype(object))
+        written = np.array([{SMT: _SMT, TH: _TH}.get(mount_of(value), -1) for value in uniques] + [-1], dtype=np.int8)[codes]
+        mount = np.where(written >= 0, written, mount)
+    if PINS_COLUMN in chunk.columns:
+        written_pins = pd.to_numeric(chunk[PINS_COLUMN], errors='coerce').to_numpy(dtype=np.float64)
+        pins = np.where(written_pins > 0, written_pins, pins)
+    price = (
+        pd.to_numeric(chunk[PRICE_COLUMN], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        if PRICE_COLUMN in chunk.columns else np.zeros(len(chunk))
+    )
+
+    # Through-hole and unknown lines take no placement time or feeder
+    smt = mount == _SMT
+    lines['Placement Time (s)'] = np.where(smt, lines['Placement Time (s)'], 0.0)
+    lines['Feeder_Master'] = np.where(smt, lines['Feeder_Master'], None)
+    lines['Pins'] = pins
+    lines['Price'] = price
+    return lines, mount
+
+
+def _side_totals(lines, mount):
+    quantity = lines['Quantity'].to_numpy()
+    smt = mount == _SMT
+    th = mount == _TH
+    joints = quantity * lines['Pins'].to_numpy()
+    return pd.DataFrame({
+        'Side': lines['Side'].to_numpy(),
+        'BOM Lines': 1,
+        'Components': quantity,
+        'SMT Components': np.where(smt, quantity, 0.0),
+        'TH Components': np.where(th, quantity, 0.0),
+        'Unknown Components': np.where(smt | th, 0.0, quantity),
+        'SMT Joints': np.where(smt, joints, 0.0),
+        'TH Barrels': np.where(th, joints, 0.0),
+        'SMT Placement CT (s)': lines['Placement Time (s)'].to_numpy(),
+        'Electronics Component ($)': quantity * lines['Price'].to_numpy(),
+    }).groupby('Side', sort=False).sum()
+
+
+def _merge_parts(parts):
+    # One row per part from several smt_placement.part_placements tables
+    if len(parts) == 1:
+        return parts[0]
+    return pd.concat(parts, ignore_index=True).groupby(
+        smt_placement.PART_COLUMNS, sort=False, dropna=False,
+    ).sum().reset_index()
+
+
+def ingest_bom(chunks, catalog):
+    """Stream the chunks of a BOM (see read_bom) into a BomSummary.
+
+    Each line is SMT or TH by its Mount column when it has one, else TH by a
+    through-hole package (DIP, TO-220, radial, ...) and SMT when SMD_Package_Feeder_Master
+    places it. Joints are Quantity x Pins, the Pins column or the package's pin
+    count; a TH joint is a barrel. Each chunk is handled in whole-column operations,
+    each distinct package looked up once for the whole BOM and only per-part totals
+    of the SMT lines kept between chunks.
+    """
+    packages = _Packages(catalog)
+    totals, parts, unplaced = [], [], []
+    for position, chunk in enumerate(chunks):
+        if position == 0:
+            missing = [column for column in smt_placement.BOM_COLUMNS if column not in chunk.columns]
+            if missing:
+                raise ValueError(f"BOM: missing column {', '.join(missing)}")
+        chunk = chunk.dropna(how='all')
+        if chunk.empty:
+            continue
+        lines, mount = _chunk_lines(chunk.reset_index(drop=True), packages)
+        totals.append(_side_totals(lines, mount))
+        # Feeders count distinct parts over the whole BOM, so only per-part totals are kept; they are
+        # merged once the newer chunks' totals outgrow the merged ones, regrouping each part a few times at most
+        parts.append(smt_placement.part_placements(lines[mount == _SMT]))
+        if len(parts) > 1 and sum(len(chunk_parts) for chunk_parts in parts[1:]) >= len(parts[0]):
+            parts = [_merge_parts(parts)]
+        unplaced.append(lines[mount == _UNKNOWN][['Side', 'Package', 'Quantity']])
+
+    if not totals:
+        raise ValueError('the BOM has no lines')
+    sides = pd.concat(totals).groupby(level=0, sort=True).sum()
+    sides['Solder Joints'] = sides['SMT Joints'] + sides['TH Barrels']
+
+    feeders = smt_placement.feeder_requirements(_merge_parts(parts))
+    sides['Feeder Slots'] = feeders.groupby('Side')['Slots'].sum().reindex(sides.index, fill_value=0)
+    trays = feeders[feeders['Feeder_Master'].isin(smt_placement.TRAY_FEEDERS)]
+    sides['Tray Parts'] = trays.groupby('Side')['Parts'].sum().reindex(sides.index, fill_value=0)
+    return BomSummary(
+        sides.rename_axis('Side').reset_index()[SIDE_COLUMNS], feeders, pd.concat(unplaced, ignore_index=True),
+    )
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+import cost_engine
+import line_simulation
+
+PLAN_COLUMNS = [
+    'Scenario', 'Stage', 'Hours Needed', 'Line-Shifts Needed', 'Lines', 'Shifts/Line', 'Utilization %',
+    'Needs Extra Shift', 'Needs Extra Line',
+]
+
+
+def max_shifts(calendar):
+    # Shifts of Shift Hr/day that fit in a day
+    return max(int(line_simulation.HOURS_PER_DAY // calendar.shift_hr_day), 1) if calendar.shift_hr_day > 0 else 1
+
+
+class CapacityModel:
+    """Cycle and set-up times of products' process maps, as products x stages matrices.
+
+    Stages are the process names (the equipment of MMR-EMS), so every row a product
+    has for a stage, e.g. Screen Printing on both SMT sides, loads the same stage, and
+    products sharing a stage load it together. Built once, then planned for any
+    number of volume scenarios in one matrix product.
+    """
+
+    def __init__(self, routings):
+        # routings: {product: process-mapping frame}
+        self.products = list(routings)
+        frames = []
+        for product, stages in routings.items():
+            cost_engine.check_columns(stages, cost_engine.STAGE_COLUMNS, f'{product} process mapping')
+            stages = stages[stages['Stage'].notna()]
+            frames.append(pd.DataFrame({
+                'Product': product,
+                'Stage': stages['Stage'].to_numpy(),
+                'Process Cycle Time': pd.to_numeric(stages['Process Cycle Time'], errors='coerce').fillna(0).to_numpy(),
+                'Batch Set up Time': pd.to_numeric(stages['Batch Set up Time'], errors='coerce').fillna(0).to_numpy(),
+            }))
+        rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['Product', 'Stage'])
+        product_codes = pd.Index(self.products).get_indexer(rows['Product'])
+        stage_codes, stages = pd.factorize(rows['Stage'])
+        self.stages = list(stages)
+
+        shape = (len(self.products), len(self.stages))
+        self.cycle_time = np.zeros(shape)
+        self.setup_time = np.zeros(shape)
+        np.add.at(self.cycle_time, (product_codes, stage_codes), rows['Process Cycle Time'].to_numpy(dtype=np.float64))
+        np.add.at(self.setup_time, (product_codes, stage_codes), rows['Batch Set up Time'].to_numpy(dtype=np.float64))
+
+    def hours_needed(self, volumes, calendar):
+        """Working hours each stage needs per year, as a scenarios x stages array.
+
+        ``volumes`` is a scenarios x products array of annual volumes. Each product is
+        set up once per batch, a batch being a month of production as in the costing.
+        """
+        volumes = np.atleast_2d(np.asarray(volumes, dtype=np.float64))
+        batches = np.where(volumes > 0, cost_engine.MONTHS_PER_YEAR, 0.0)
+        seconds = volumes @ self.cycle_time + batches @ self.setup_time
+        efficiency = calendar.efficiency if calendar.efficiency > 0 else 1.0
+        return seconds / cost_engine.SECONDS_PER_HOUR / efficiency
+
+    def plan(self, volumes, calendar, scenarios=None):
+        """Lines and shifts each stage needs in every volume scenario, one row per scenario and stage.
+
+        A line runs up to max_shifts(calendar) shifts a day; a stage gets the fewest
+        lines that cover its hours and then the fewest shifts on each. Stages needing
+        more than one shift or line are flagged.
+        """
+        shift_hours = calendar.hours_per_year()
+        if not shift_hours > 0:
+            raise ValueError('Shift Hr/day, Days/Week and Weeks/Year must give a working year')
+        hours = self.hours_needed(volumes, calendar)
+        n_scenarios = hours.shape[0]
+        line_shifts = hours / shift_hours
+
+        shifts_per_line = max_shifts(calendar)
+        lines = np.where(hours > 0, np.maximum(np.ceil(line_shifts / shifts_per_line), 1), 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shifts = np.where(lines > 0, np.ceil(line_shifts / lines), 0)
+            utilization = np.where(lines > 0, line_shifts / (lines * shifts) * 100, 0.0)
+
+        scenarios = list(scenarios) if scenarios is not None else list(range(1, n_scenarios + 1))
+        return pd.DataFrame({
+            'Scenario': np.repeat(scenarios, len(self.stages)),
+            'Stage': np.tile(self.stages, n_scenarios),
+            'Hours Needed': hours.ravel(),
+            'Line-Shifts Needed': line_shifts.ravel(),
+            'Lines': lines.ravel().astype(np.int64),
+            'Shifts/Line': shifts.ravel().astype(np.int64),
+            'Utilization %': utilization.ravel(),
+            'Needs Extra Shift': shifts.ravel() > 1,
+            'Needs Extra Line': lines.ravel() > 1,
+        }, columns=PLAN_COLUMNS)
+
+
+def volume_scenarios(annual_volumes, products):
+    # Every product at each annual volume: a scenarios x products array
+    return np.repeat(np.asarray(annual_volumes, dtype=np.float64)[:, np.newaxis], len(products), axis=1)
+
+
+def flagged(plan):
+    # Scenario and stage rows that need more than one shift or line
+    return plan[plan['Needs Extra Shift'] | plan['Needs Extra Line']]
+
+
+def scenario_summary(plan):
+    # Per scenario: the most lines and shifts any stage needs, the busiest stage and the flagged stage count
+    return plan.assign(**{'Flagged Stages': plan['Needs Extra Shift'] | plan['Needs Extra Line']}).groupby(
+        'Scenario', sort=False
+    ).agg(**{
+        'Lines': ('Lines', 'max'),
+        'Shifts/Line': ('Shifts/Line', 'max'),
+        'Max Utilization %': ('Utilization %', 'max'),
+        'Flagged Stages': ('Flagged Stages', 'sum'),
+    })
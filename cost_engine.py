@@ -0,0 +1,256 @@
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import stage_matching
+
+# Process-cost formulas of the costing pages, on NumPy arrays and free of Streamlit so that
+# scripts and workers can cost stage rows in bulk
+
+# Labour overhead applied to batch set-up and labour time
+LABOUR_OVERHEAD = 1.15
+
+# Batches are sized as a month of production
+MONTHS_PER_YEAR = 12
+
+SECONDS_PER_HOUR = 3600
+
+# Columns added to the merged stage rows
+COST_COLUMNS = ['VA MC Cost', 'Batch Set up Cost', 'Labour cost/Hr']
+
+# OH&P percentages by annual-volume band (the 'OHP % Model' of simulation_db.xlsx)
+OHP_PERCENTAGES = {
+    "<100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1.5, "Profit on VA %": 8, "R&D %": 1, "Warranty %": 1, "SG&A %": 3},
+    ">100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 2, "Warranty %": 1, "SG&A %": 2},
+    "5K/10K": {"MOH %": 1, "FOH %": 20, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 3, "Warranty %": 1, "SG&A %": 4},
+}
+
+STAGE_COLUMNS = ['Stage', 'Process Cycle Time', 'Batch Set up Time']
+MMR_COLUMNS = ['Process Name', 'MMR', 'FTE for Batch Set up', 'DL FTE', 'IDL FTE']
+ASSUMPTION_COLUMNS = ['Labour cost/Hr', 'Idl Cost/Hr']
+
+
+def batch_quantity(annual_volume):
+    # A month of production per batch; without a volume every board is its own batch
+    return annual_volume / MONTHS_PER_YEAR if annual_volume > 0 else 1
+
+
+def stage_cost_arrays(process_cycle_time, batch_setup_time, mmr, fte_batch_setup, dl_fte, idl_fte,
+                      labour_cost_hr, idl_cost_hr, annual_volume):
+    """VA MC Cost, Batch Set up Cost and Labour cost/Hr of each stage row, as float64 arrays."""
+    process_cycle_time = np.asarray(process_cycle_time, dtype=np.float64)
+    batch_setup_time = np.asarray(batch_setup_time, dtype=np.float64)
+
+    va_mc_cost = process_cycle_time * np.asarray(mmr, dtype=np.float64)
+    batch_setup_cost = (
+        (((batch_setup_time * labour_cost_hr) / SECONDS_PER_HOUR) * LABOUR_OVERHEAD) / batch_quantity(annual_volume)
+    ) * np.asarray(fte_batch_setup, dtype=np.float64)
+    labour_cost = (
+        ((((process_cycle_time * labour_cost_hr) / SECONDS_PER_HOUR) * LABOUR_OVERHEAD) * np.asarray(dl_fte, dtype=np.float64))
+        + ((((process_cycle_time * idl_cost_hr) / SECONDS_PER_HOUR) * LABOUR_OVERHEAD) * np.asarray(idl_fte, dtype=np.float64))
+    )
+    return va_mc_cost, batch_setup_cost, labour_cost
+
+
+def check_columns(frame, columns, sheet_name):
+    missing = [column for column in columns if column not in frame.columns]
+    if missing:
+        raise KeyError(f"{sheet_name}: {', '.join(missing)}")
+
+
+class MmrIndex:
+    """MMR-EMS rows indexed by Process Name, built once per master-data revision.
+
+    Stages find their process name through a StageMatcher: on the normalized name,
+    then the alias table, then by close trigram similarity. The rows of each process
+    name are kept in CSR form (offsets into an array of row positions), so joining a
+    process map is a lookup of the stage codes followed by array gathers. The columns
+    are those of stages.merge(mmr, left_on='Stage', right_on='Process Name',
+    how='inner'), including the repeated rows of a process name listed more than once
+    and the _x/_y suffixes of shared column names; blank stages never match.
+    """
+
+    def __init__(self, mmr, aliases=None):
+        check_columns(mmr, MMR_COLUMNS, 'MMR-EMS')
+        self.mmr = mmr.reset_index(drop=True)
+        self.matcher = stage_matching.StageMatcher(self.mmr['Process Name'], aliases)
+        codes = self.matcher.codes
+        self.names = self.matcher.names
+        named = np.flatnonzero(codes >= 0)
+        self.row_positions = named[np.argsort(codes[named], kind='stable')]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[named], minlength=len(self.names)))])
+
+    def __len__(self):
+        return len(self.names)
+
+    def nbytes(self):
+        return (
+            int(self.mmr.memory_usage(deep=True).sum()) + self.row_positions.nbytes + self.offsets.nbytes
+            + self.matcher.nbytes()
+        )
+
+    def with_mmr(self, mmr_values):
+        # The same index with the MMR column replaced, e.g. by rates worked out from Machine data
+        index = copy.copy(self)
+        index.mmr = self.mmr.assign(MMR=np.asarray(mmr_values, dtype=np.float64))
+        return index
+
+    def stage_codes(self, stage_names):
+        # Position of each stage's process name, -1 when it has none
+        return self.matcher.match(stage_names)[0]
+
+    def match_report(self, stages):
+        # Stage rows matched approximately or not at all (see StageMatcher.report)
+        return self.matcher.report(stages['Stage'])
+
+    def join(self, stages):
+        check_columns(stages, STAGE_COLUMNS, 'process mapping')
+        codes = self.stage_codes(stages['Stage'])
+        counts = np.where(codes >= 0, self.offsets[codes + 1] - self.offsets[codes], 0)
+
+        # Every stage row repeated once per matching MMR row, the MMR rows in sheet order
+        left_positions = np.repeat(np.arange(len(stages)), counts)
+        starts = np.repeat(self.offsets[np.maximum(codes, 0)], counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        right_positions = self.row_positions[starts + within]
+
+        left = stages.take(left_positions)
+        right = self.mmr.take(right_positions)
+        left.index = right.index = pd.RangeIndex(len(left_positions))
+        shared = set(left.columns.intersection(right.columns))
+        left.columns = [f'{column}_x' if column in shared else column for column in left.columns]
+        right.columns = [f'{column}_y' if column in shared else column for column in right.columns]
+        return pd.concat([left, right], axis=1)
+
+
+def merge_stages(stages, mmr):
+    # Each stage row matched with the MMR-EMS rows of its process name
+    if not isinstance(mmr, MmrIndex):
+        mmr = MmrIndex(mmr)
+    return mmr.join(stages)
+
+
+def compute_stage_costs(stages, mmr, assumptions, annual_volume):
+    """Cost the stage rows of a process map.
+
+    ``stages`` is a process-mapping sheet, ``mmr`` the MMR-EMS sheet (or its MmrIndex)
+    and ``assumptions`` the Assumptions sheet (its first row is used). Returns the
+    stages matched with their MMR-EMS rows plus the COST_COLUMNS; raises KeyError
+    naming the missing columns.
+    """
+    check_columns(stages, STAGE_COLUMNS, 'process mapping')
+    return add_stage_costs(merge_stages(stages, mmr), assumptions, annual_volume)
+
+
+def add_stage_costs(merged, assumptions, annual_volume):
+    # The merged stage rows may be shared through a cache, so the costs go on a copy
+    check_columns(assumptions, ASSUMPTION_COLUMNS, 'Assumptions')
+    costs = merged.copy()
+    costs['VA MC Cost'], costs['Batch Set up Cost'], costs['Labour cost/Hr'] = stage_cost_arrays(
+        costs['Process Cycle Time'].to_numpy(),
+        costs['Batch Set up Time'].to_numpy(),
+        costs['MMR'].to_numpy(),
+        costs['FTE for Batch Set up'].to_numpy(),
+        costs['DL FTE'].to_numpy(),
+        costs['IDL FTE'].to_numpy(),
+        assumptions['Labour cost/Hr'].iloc[0],
+        assumptions['Idl Cost/Hr'].iloc[0],
+        annual_volume,
+    )
+    return costs
+
+
+def cost_rollup(stage_costs, pcb_comp_mech_cost, nre_per_unit, percentages):
+    """OH&P rollup of costed stage rows into the Cost Computation and Cost Summary values.
+
+    ``pcb_comp_mech_cost`` is PCB + electronics + mechanical components per board and
+    ``percentages`` one entry of OHP_PERCENTAGES.
+    """
+    batch_setup = stage_costs['Batch Set up Cost'].sum()
+    va_machine = stage_costs['VA MC Cost'].sum()
+    labour = stage_costs['Labour cost/Hr'].sum()
+    value_added = batch_setup + va_machine + labour
+
+    moh = pcb_comp_mech_cost * (percentages["MOH %"] / 100)
+    foh = value_added * (percentages["FOH %"] / 100)
+    profit_on_rm = pcb_comp_mech_cost * (percentages["Profit on RM %"] / 100)
+    profit_on_va = value_added * (percentages["Profit on VA %"] / 100)
+
+    material = pcb_comp_mech_cost + nre_per_unit
+    manufacturing = batch_setup + va_machine + labour
+    r_n_d = (material + manufacturing) * (percentages["R&D %"] / 100)
+    warranty = (material + manufacturing) * (percentages["Warranty %"] / 100)
+    sg_and_a = (material + manufacturing) * (percentages["SG&A %"] / 100)
+    total = (material + manufacturing) + moh + foh + profit_on_rm + profit_on_va + r_n_d + warranty + sg_and_a
+
+    return {
+        'Batch Set up Cost ($)': batch_setup,
+        'VA MC Cost ($)': va_machine,
+        'Labour Cost ($)': labour,
+        'MOH ($)': moh,
+        'FOH ($)': foh,
+        'Profit on RM ($)': profit_on_rm,
+        'Profit on VA ($)': profit_on_va,
+        'Material Cost ($)': material,
+        'Manufacturing Cost ($)': manufacturing,
+        'OH&P ($)': moh + foh + profit_on_rm + profit_on_va,
+        'R&D ($)': r_n_d,
+        'Warranty ($)': warranty,
+        'SG&A ($)': sg_and_a,
+        'Total Cost ($)': total,
+        'RM Cost ($)': material,
+        'Conversion Cost ($)': total - material,
+    }
+
+
+def cost_sheet(sheet_name, stages, mmr, assumptions, annual_volume, pcb_comp_mech_cost, nre_per_unit, percentages,
+               consumables=0.0):
+    # The whole pipeline for one process-mapping sheet; module level so process pools can run it
+    if not isinstance(mmr, MmrIndex):
+        mmr = MmrIndex(mmr)
+    stage_costs = compute_stage_costs(stages, mmr, assumptions, annual_volume)
+    summary = {
+        'Sheet': sheet_name,
+        'Matched Stages': len(stage_costs),
+        'Flagged Stages': len(mmr.match_report(stages)),
+        'Consumables ($)': consumables,
+    }
+    summary.update(cost_rollup(stage_costs, pcb_comp_mech_cost, nre_per_unit, percentages))
+    return summary
+
+
+def cost_all_sheets(sheets, mmr, assumptions, annual_volume, pcb_comp_mech_cost, nre_per_unit, percentages,
+                    consumables=0.0, max_workers=1):
+    """Cost every {sheet name: stages} of a process-mapping workbook.
+
+    Sheets are costed one after another unless ``max_workers`` asks for a process pool;
+    a pool only pays off for very large workbooks, and its workers are spawned rather
+    than forked since the app's loader threads may be running. Returns one row per
+    sheet, in the order given, with the rollup values; a sheet that cannot be costed
+    gets its error in the 'Error' column instead.
+    """
+    arguments = (mmr, assumptions, annual_volume, pcb_comp_mech_cost, nre_per_unit, percentages, consumables)
+    rows = []
+    if max_workers is not None and max_workers <= 1:
+        for sheet_name, stages in sheets.items():
+            try:
+                rows.append(cost_sheet(sheet_name, stages, *arguments))
+            except Exception as e:
+                rows.append({'Sheet': sheet_name, 'Error': str(e)})
+        return pd.DataFrame(rows).set_index('Sheet')
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {
+            sheet_name: pool.submit(cost_sheet, sheet_name, stages, *arguments)
+            for sheet_name, stages in sheets.items()
+        }
+        for sheet_name, future in futures.items():
+            try:
+                rows.append(future.result())
+            # A broken pool or an argument that cannot be pickled fails the sheet, not the page
+            except Exception as e:
+                rows.append({'Sheet': sheet_name, 'Error': str(e) or type(e).__name__})
+    return pd.DataFrame(rows).set_index('Sheet')
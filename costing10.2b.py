@@ -4,13 +4,28 @@ import openpyxl
 import numpy as np
 from openpyxl.utils.dataframe import dataframe_to_rows
 import matplotlib
-import os
-import tempfile
 import io
 import plotly.graph_objects as go
 import uuid  # Add this import at the top of your script
 import math
+import os
+import concurrent.futures
 import plotly.express as px
+import bom_ingest
+import capacity
+import cost_engine
+import export
+import line_balancing
+import line_simulation
+import machine_rates
+import master_data
+import master_store
+import nre
+import process_mapping
+import shared_cache
+import sheet_schema
+import smt_placement
+import stage_matching
 
 # Set the page layout to wide
 st.set_page_config(layout="wide")
@@ -27,6 +42,125 @@ with st.sidebar.expander("Analysis"):
     new_analysis = st.checkbox("New")
     existing_analysis = st.checkbox("Existing")
 
+# Parse the master workbook once per content hash; the parsed sheets live in the process-wide
+# shared cache, so every session reads the same copy
+def load_master_data(digest, data):
+    # On a first upload the sheets are parsed in the background; see wait_for_sheets
+    master = shared_cache.CACHE.get_or_load(('master', digest), lambda: master_data.start_master_data(data, digest))
+    shared_cache.CACHE.resize(('master', digest))
+    return master
+
+# Show a progress bar until the given sheets of a background parse are ready
+def wait_for_sheets(master, sheet_names, label):
+    if not isinstance(master, master_data.PendingMasterData):
+        return
+    futures = master.futures(sheet_names)
+    if all(future.done() for future in futures):
+        return
+    progress_bar = st.progress(master.progress(), text=label)
+    while concurrent.futures.wait(futures, timeout=0.1).not_done:
+        progress_bar.progress(master.progress(), text=label)
+    progress_bar.empty()
+
+# Master data imported into the local SQLite store, reloaded only when a new revision is imported
+def load_stored_master_data(digest):
+    with st.spinner("Reading the master-data store..."):
+        return shared_cache.CACHE.get_or_load(('store', digest), master_store.load_master_data)
+
+# Open an uploaded Excel/CSV/XLSM file; sheets (or the virtual sheets of a CSV) are parsed only when they are selected
+def open_workbook(data, file_name):
+    if file_name.endswith('.csv'):
+        workbook = process_mapping.CsvWorkbook(data, file_name)
+    else:
+        workbook = process_mapping.LazyWorkbook(data, file_name)
+    # The first sheet is what the sheet selector shows first; start parsing it right away
+    workbook.prefetch(workbook.sheet_names[:1])
+    return workbook
+
+def load_data(digest, data, file_name):
+    key = ('workbook', digest, file_name.endswith('.csv'))
+    workbook = shared_cache.CACHE.get_or_load(key, lambda: open_workbook(data, file_name))
+    # Sheets parsed on earlier reruns count against the cache budget
+    shared_cache.CACHE.resize(key)
+    return workbook
+
+# Content hashes of some sheets of a master-data revision, each worked out once per revision.
+# Results built from a few sheets are cached on the hashes of those sheets only, so a new
+# revision that leaves them alone (a Process_CT edit, say) reuses them
+def sheet_versions(master, *sheet_names):
+    return tuple(
+        shared_cache.CACHE.get_or_load(
+            ('sheet_digest', master.digest, sheet_name),
+            lambda: master_data.sheet_digest(getattr(master, master_data.SHEET_FIELDS[sheet_name])),
+        )
+        for sheet_name in sheet_names
+    )
+
+# Stage matching index of the MMR-EMS sheet, with the aliases of the 'Stage Aliases' sheet
+def load_mmr_index(master):
+    return shared_cache.CACHE.get_or_load(
+        ('mmr_index',) + sheet_versions(master, 'MMR-EMS', 'Stage Aliases'),
+        lambda: cost_engine.MmrIndex(master.mmr, stage_matching.alias_table(master.stage_aliases)),
+    )
+
+def load_machine_rates(master):
+    # None when the workbook has no 'Machine data' sheet
+    if master.machine_data is None:
+        return None
+    return shared_cache.CACHE.get_or_load(
+        ('machine_rates',) + sheet_versions(master, master_data.MACHINE_SHEET, 'MMR-EMS'),
+        lambda: machine_rates.MachineRates(master.machine_data, master.mmr),
+    )
+
+def costing_mmr_index(master, rate_assumptions=None):
+    # The MMR-EMS index, with the rates worked out from Machine data when there are assumptions for them
+    mmr_index = load_mmr_index(master)
+    if rate_assumptions is None:
+        return mmr_index
+    return mmr_index.with_mmr(load_machine_rates(master).mmr_column(rate_assumptions))
+
+def load_package_catalog(master):
+    # None when the workbook has no SMD_Package_Feeder_Master sheet
+    if master.smd_packages is None:
+        return None
+    return shared_cache.CACHE.get_or_load(
+        ('package_catalog',) + sheet_versions(master, 'SMD_Package_Feeder_Master'),
+        lambda: smt_placement.PackageCatalog(master.smd_packages),
+    )
+
+def load_bom(master, package_catalog, data, file_name):
+    # One ingest per BOM and package catalog, streamed in chunks
+    return shared_cache.CACHE.get_or_load(
+        ('bom', master_data.content_hash(data)) + sheet_versions(master, 'SMD_Package_Feeder_Master'),
+        lambda: bom_ingest.ingest_bom(bom_ingest.read_bom(data, file_name), package_catalog),
+    )
+
+# Hit/miss counters of the shared cache, for whoever runs the server
+with st.sidebar.expander("Cache"):
+    cache_stats = shared_cache.CACHE.stats()
+    st.caption(
+        f"{cache_stats['entries']} workbook(s), {cache_stats['size_mb']:.1f} of {cache_stats['max_mb']:.0f} MB; "
+        f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['evictions']} evictions"
+    )
+
+# Single NRE items, MMR-EMS processes and packages straight from the master-data store's indexes
+if master_store.stored_digest():
+    with st.sidebar.expander("Master-Data Store Lookup"):
+        store_lookup = st.selectbox("Look up", ["NRE Item", "MMR-EMS Process Name", "SMD Package"], key='store_lookup')
+        store_lookup_value = st.text_input("Name", key='store_lookup_value').strip()
+        if store_lookup_value:
+            if store_lookup == "NRE Item":
+                store_rows = [master_store.nre_item(store_lookup_value)]
+            elif store_lookup == "MMR-EMS Process Name":
+                store_rows = master_store.mmr_for_process(store_lookup_value)
+            else:
+                store_rows = [master_store.package(store_lookup_value)]
+            store_rows = [row for row in store_rows if row]
+            if store_rows:
+                st.dataframe(pd.DataFrame(store_rows))
+            else:
+                st.caption(f"'{store_lookup_value}' is not in the master-data store.")
+
 # Display selected analysis
 if new_analysis:
     st.subheader("New Analysis")
@@ -34,14 +168,39 @@ if new_analysis:
     # File uploader for the first Excel file (simulation_db.xlsx, sheet 'Process_CT')
     uploaded_file_simulation_db = st.file_uploader("Upload the simulation_db.xlsx file", type=["xlsx"])
     
+    # Without an upload, use the master data imported into the local store
+    stored_master_digest = master_store.stored_digest()
+
     # Load data if the file is uploaded
-    if uploaded_file_simulation_db:        
+    if uploaded_file_simulation_db or stored_master_digest:        
         try:
-            df = pd.read_excel(uploaded_file_simulation_db, sheet_name='Process_CT')
+            if uploaded_file_simulation_db:
+                simulation_db_bytes = uploaded_file_simulation_db.getvalue()
+                master = load_master_data(master_data.content_hash(simulation_db_bytes), simulation_db_bytes)
+            else:
+                master = load_stored_master_data(stored_master_digest)
+                st.caption("Using the stored master data. Upload simulation_db.xlsx to use another revision.")
+            # The volume and NRE section only needs these two sheets; the rest keeps parsing
+            wait_for_sheets(master, ['Process_CT', 'NRE'], "Reading simulation_db.xlsx...")
+            df = master.process_ct
             # st.write("File successfully read. Preview below:")
             # st.dataframe(df.head())
         except Exception as e:
             st.error(f"Error while reading the file: {e}")
+            st.stop()
+
+        # Offer to keep an uploaded revision in the store for later analyses
+        if uploaded_file_simulation_db and master.digest != stored_master_digest:
+            if st.button("Save to Master-Data Store"):
+                store_report = master_store.import_master_data(master)
+                if store_report:
+                    st.success("simulation_db.xlsx saved to the master-data store. Changed rows:")
+                    st.dataframe(master_store.report_frame(store_report))
+                    for sheet_name, changes in store_report.items():
+                        with st.expander(f"{sheet_name} changes"):
+                            st.write({key: value for key, value in changes.items() if value})
+                else:
+                    st.success("The master-data store is already up to date.")
             
         # Extract the required values
         shift_hr_day = df.at[0, 'Shift Hr/day']
@@ -65,8 +224,8 @@ if new_analysis:
         with col3:
             overall_labor_efficiency_input = st.text_input('Overall Labor Efficiency', value=overall_labor_efficiency, disabled=True)
 
-        # Load the specific sheet from simulation_db.xlsx for 'NRE'
-        df2 = pd.read_excel(uploaded_file_simulation_db, sheet_name='NRE')
+        # The 'NRE' sheet from simulation_db.xlsx
+        df2 = master.nre
 
         st.write("-------------------")
 
@@ -77,8 +236,10 @@ if new_analysis:
         if 'data' not in st.session_state:
             st.session_state['data'] = initial_df
 
-        if 'filtered_data' not in st.session_state:
-            st.session_state['filtered_data'] = initial_df
+        # NRE Mapping lines: append-only with delete and undo/redo, see nre.NreBuffer
+        if 'nre_buffer' not in st.session_state:
+            st.session_state['nre_buffer'] = nre.NreBuffer(initial_df.columns)
+        nre_buffer = st.session_state['nre_buffer']
 
         # Initialize dropdown values if not set
         if 'item' not in st.session_state:
@@ -137,18 +298,22 @@ if new_analysis:
         header_cols[3].markdown("<h6 style='text-align: center;'>Qty for LCV</h6>", unsafe_allow_html=True)
         header_cols[4].markdown("<h6 style='text-align: center;'>Extended Price (₹)</h6>", unsafe_allow_html=True)
         
+        # NRE items indexed once per master-data revision and shared by every session
+        nre_catalog = shared_cache.CACHE.get_or_load(('nre',) + sheet_versions(master, 'NRE'), lambda: nre.NreCatalog(df2))
+
         # Function to display a row
         def display_row():
             row_cols = st.columns(5)
             
             # Select boxes to select the “Item”
-            item = row_cols[0].selectbox('', [''] + list(df2['Item'].unique()), key=f'item_{st.session_state.reset_selectbox}')
-            unit_price = df2[df2['Item'] == item]['Unit Price (₹)'].values[0] if item else ''
-            life_cycle_boards = df2[df2['Item'] == item]['Life Cycle (Boards)'].values[0] if item else ''
+            item = row_cols[0].selectbox('', nre_catalog.options, key=f'item_{st.session_state.reset_selectbox}')
+            record = nre_catalog.record(item, product_volume) if item else {}
+            unit_price = record.get('Unit Price (₹)', '')
+            life_cycle_boards = record.get('Life Cycle (Boards)', '')
             
-            # Apply the formula for Qty for LCV
-            qty_for_lcv = 1 * (max(product_volume, life_cycle_boards) / life_cycle_boards) if life_cycle_boards else ''
-            ext_price = unit_price * qty_for_lcv if unit_price and qty_for_lcv else ''
+            # Qty for LCV and Extended Price come from the catalog, worked out for every item at this Product Volume
+            qty_for_lcv = record['Qty for LCV'] if life_cycle_boards else ''
+            ext_price = record['Extended Price (₹)'] if unit_price and qty_for_lcv else ''
 
             with row_cols[1]:
                 unit_price_input = st.text_input('', value=unit_price, key=f'unit_price_{st.session_state.reset_selectbox}')
@@ -185,8 +350,7 @@ if new_analysis:
                         'Qty for LCV': qty_for_lcv,
                         'Extended Price (₹)': ext_price
                     }
-                    if not st.session_state['filtered_data']['Item'].eq(item).any():
-                        st.session_state['filtered_data'] = pd.concat([st.session_state['filtered_data'], pd.DataFrame([new_row])], ignore_index=True)
+                    if nre_buffer.add([new_row]):
                         st.success("Record added successfully. Select Your Next Side & Stage")
                     else:
                         st.warning("Record Already Exists in the Table")
@@ -196,33 +360,126 @@ if new_analysis:
                 # Increment the key to reset the select boxes
                 st.session_state['reset_selectbox'] += 1
 
+        # Bulk mode: price a whole list of fixtures, stencils and pallets in one action
+        with st.expander("Add Several NRE Items"):
+            bulk_items = st.multiselect("Select the NRE items", nre_catalog.items, key=f'bulk_items_{st.session_state.reset_selectbox}')
+            pasted_items = st.text_area("Or paste the item names, one per line", key=f'bulk_paste_{st.session_state.reset_selectbox}')
+
+            if st.button('Add Items'):
+                requested_items = list(dict.fromkeys(bulk_items + nre.parse_item_list(pasted_items)))
+                unknown_items = nre_catalog.unknown_items(requested_items)
+                if unknown_items:
+                    st.warning(f"Not found in the NRE sheet: {', '.join(unknown_items)}")
+
+                added_count = nre_buffer.add(nre_catalog.price_items(
+                    [item for item in requested_items if item not in nre_buffer], product_volume
+                ))
+                if added_count:
+                    st.success(f"{added_count} record(s) added successfully.")
+                elif len(requested_items) > len(unknown_items):
+                    st.warning("Records Already Exist in the Table")
+
+        # Filled after the bulk expander, so the delete list already holds the lines added on this run
+        with delete_col3:
+            delete_item = st.selectbox('Item to delete', [''] + nre_buffer.items(), key='nre_delete_item')
+            if st.button('Delete') and delete_item:
+                nre_buffer.delete([delete_item])
+                st.success(f"Deleted {delete_item}")
+
+        with delete_col4:
+            undo_col, redo_col = st.columns(2)
+            with undo_col:
+                if st.button('Undo', disabled=not nre_buffer.can_undo()):
+                    nre_buffer.undo()
+            with redo_col:
+                if st.button('Redo', disabled=not nre_buffer.can_redo()):
+                    nre_buffer.redo()
+
         # Display the updated dataframe with a header
         st.markdown("## NRE Mapping")
-        st.dataframe(st.session_state['filtered_data'], use_container_width=True)
+        nre_lines = nre_buffer.frame()
+        st.dataframe(nre_lines, use_container_width=True)
 
         totalcost_col1, toolmaintenance_col2, totalextendedprice_col3, nreperunit_col4 = st.columns(4)
 
-        with totalcost_col1:
-            # Convert the 'Extended Price (₹)' column to numeric
-            st.session_state['filtered_data']['Extended Price (₹)'] = pd.to_numeric(st.session_state['filtered_data']['Extended Price (₹)'], errors='coerce')            
-            # Calculate the total cost
-            total_cost = st.session_state['filtered_data']['Extended Price (₹)'].sum()
-            total_cost_value = float(total_cost)
-            st.text_input('Total Cost (₹)', value=total_cost, disabled=True)
-
         with toolmaintenance_col2:
             tool_maintenance_rate = st.text_input('Tool Maintenance Rate (%)', value="", disabled=False)
             tool_maintenance_rate_value = float(tool_maintenance_rate) / 100 if tool_maintenance_rate else 0.0
 
+        # Lines saved from the text boxes hold text, so convert to numbers first
+        nre_totals = nre.summarize(
+            pd.to_numeric(nre_lines['Extended Price (₹)'], errors='coerce'), product_volume, tool_maintenance_rate_value
+        )
+        total_cost = nre_totals['Total Cost (₹)']
+        total_extended_price = nre_totals['Extended Price (₹)']
+        nre_per_unit = nre_totals['NRE per Unit (₹)']
+
+        with totalcost_col1:
+            st.text_input('Total Cost (₹)', value=total_cost, disabled=True)
+
         with totalextendedprice_col3:
-            tool_maintenance_cost = total_cost_value * tool_maintenance_rate_value
-            total_extended_price = total_cost_value + tool_maintenance_cost
             st.text_input('Total Extended Price (₹)', value=total_extended_price, disabled=True)
 
         with nreperunit_col4:
-            nre_per_unit = total_extended_price / product_volume if product_volume else 0
             st.text_input('NRE per Unit (₹)', value=nre_per_unit, disabled=True)
 
+        # NRE per Unit of the current mapping for many volume/life pairs at once, for quotes
+        with st.expander("NRE per Unit across Annual Volumes and Product Lives"):
+            surface_col1, surface_col2 = st.columns(2)
+            with surface_col1:
+                surface_volumes = st.text_input('Quote Annual Volumes', value="5000, 10000, 20000, 50000, 100000, 250000")
+            with surface_col2:
+                surface_lives = st.text_input('Quote Product Lives', value="1, 2, 3, 5, 7, 10")
+
+            try:
+                surface_volumes = nre.parse_number_list(surface_volumes)
+                surface_lives = nre.parse_number_list(surface_lives)
+            except ValueError:
+                st.warning("Enter the annual volumes and product lives as numbers separated by commas.")
+            else:
+                nre_per_unit_surface = pd.DataFrame(
+                    nre.nre_surface(
+                        pd.to_numeric(nre_lines['Unit Price (₹)'], errors='coerce'),
+                        pd.to_numeric(nre_lines['Life Cycle (Boards)'], errors='coerce'),
+                        surface_volumes, surface_lives, tool_maintenance_rate_value,
+                    ),
+                    index=pd.Index(surface_volumes, name='Annual Volume'),
+                    columns=pd.Index(surface_lives, name='Product Life'),
+                )
+                surface_fig = go.Figure(go.Heatmap(
+                    z=nre_per_unit_surface.values,
+                    x=[f"{life:g}" for life in surface_lives],
+                    y=[f"{volume:g}" for volume in surface_volumes],
+                    colorbar=dict(title='NRE per Unit (₹)'),
+                ))
+                surface_fig.update_layout(xaxis_title='Product Life', yaxis_title='Annual Volume')
+                st.plotly_chart(surface_fig, use_container_width=True)
+                st.dataframe(nre_per_unit_surface, use_container_width=True)
+
+        # Tooling shared by a product family, sized on the pooled volume and split back per product
+        with st.expander("Portfolio NRE Allocation"):
+            st.caption("Upload a table with one row per product and NRE item: Product, Item, Annual Volume, Product Life.")
+            portfolio_file = st.file_uploader("Choose the portfolio Excel/CSV file", type=["xlsx", "csv"], key='portfolio_file')
+            if portfolio_file:
+                if portfolio_file.name.endswith('.csv'):
+                    portfolio_usage = pd.read_csv(portfolio_file)
+                else:
+                    portfolio_usage = pd.read_excel(portfolio_file)
+
+                missing_columns = [column for column in ['Product', 'Item', 'Annual Volume', 'Product Life'] if column not in portfolio_usage.columns]
+                if missing_columns:
+                    st.error(f"The portfolio file is missing the column(s): {', '.join(missing_columns)}")
+                else:
+                    portfolio_products, portfolio_items, unknown_items = nre.allocate_portfolio(
+                        portfolio_usage, nre_catalog, tool_maintenance_rate_value
+                    )
+                    if unknown_items:
+                        st.warning(f"Not found in the NRE sheet: {', '.join(map(str, unknown_items))}")
+                    st.markdown("#### NRE per Product")
+                    st.dataframe(portfolio_products, use_container_width=True)
+                    st.markdown("#### Shared NRE Items")
+                    st.dataframe(portfolio_items, use_container_width=True)
+
         # Provide inputs for file name, sheet name, and path
         st.markdown("### Save Data to Excel")
 
@@ -230,53 +487,93 @@ if new_analysis:
         file_name = st.text_input("Enter the Excel file name (with .xlsx extension):")
         sheet_name = st.text_input("Enter the sheet name:")
 
-        # Add a button to save the entire DataFrame
-        if st.button("Save DataFrame to Excel"):
-            with tempfile.TemporaryDirectory() as tmpdirname:
-                full_path = os.path.join(tmpdirname, file_name)
+        include_costing = st.checkbox("Include the process costing sheets")
 
-                # Write data to Excel file
-                with pd.ExcelWriter(full_path, engine='openpyxl') as writer:
-                    # Prepare the DataFrame for saving
-                    final_df = st.session_state['filtered_data'].copy()
-                    
-                    # Add the additional fields in the first row
-                    for col, value in zip(
-                        ['Annual Volume', 'Product Life', 'Product Volume', 'Total Cost (₹)', 'Tool Maintenance Rate (%)', 
-                        'Extended Price (₹)', 'NRE Per Unit ($)'],
-                        [annual_volume, product_life, product_volume, total_cost, tool_maintenance_rate_value, 
-                        total_extended_price, nre_per_unit]):
-                        final_df.at[0, col] = value
-                    final_df.to_excel(writer, sheet_name=sheet_name, index=False)
-                
-                # Load the saved file and create a download link
-                with open(full_path, "rb") as f:
-                    st.download_button(
-                        label="Download Excel file",
-                        data=f,
-                        file_name=file_name,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+        # Add a button to save the entire DataFrame; the workbook is built in memory
+        if st.button("Save DataFrame to Excel"):
+            nre_parameters = dict(zip(
+                ['Annual Volume', 'Product Life', 'Product Volume', 'Total Cost (₹)', 'Tool Maintenance Rate (%)',
+                'Extended Price (₹)', 'NRE Per Unit ($)'],
+                [annual_volume, product_life, product_volume, total_cost, tool_maintenance_rate_value,
+                total_extended_price, nre_per_unit]))
+            try:
+                nre_workbook_bytes = export.nre_workbook(
+                    nre_lines, nre_parameters, sheet_name=sheet_name or 'NRE',
+                    costing=st.session_state.get('edited_sheets') if include_costing else None,
+                )
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.download_button(
+                    label="Download Excel file",
+                    data=nre_workbook_bytes,
+                    file_name=file_name,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
         st.write("-------------------")
 
-        # Load the specific sheet from simulation_db.xlsx for 'MMR-EMS'
-        df3 = pd.read_excel(uploaded_file_simulation_db, sheet_name='MMR-EMS')
-        df4 = pd.read_excel(uploaded_file_simulation_db, sheet_name='Assumptions')
+        # The 'MMR-EMS' and 'Assumptions' sheets from simulation_db.xlsx
+        wait_for_sheets(master, master_data.SHEET_FIELDS, "Reading the MMR-EMS and remaining sheets...")
+        df3 = master.mmr
+        df4 = master.assumptions
+
+        # Cells that did not fit the sheet schemas were filled with 0; list them once here
+        if not master.issues.empty:
+            with st.expander(f"simulation_db.xlsx: {len(master.issues)} cell(s) could not be read as numbers"):
+                st.dataframe(master.issues)
+
+        # Machine-minute rates worked out from the 'Machine data' sheet, used in place of MMR-EMS's when chosen
+        rate_assumptions = None
+        machine_mmr = load_machine_rates(master)
+        if machine_mmr is not None:
+            with st.expander("Machine-minute Rates (Machine data)"):
+                st.write(
+                    "Works out each machine's MMR from its cost, lifetime, AMC, auxiliary cost, wattage, floor area, "
+                    "shifts and OEE, as the 'Machine data' sheet does. MMR-EMS processes matched to a machine are "
+                    "costed at its rate; the others keep their MMR."
+                )
+                sheet_attributes = machine_rates.attribute_values(master.machine_attributes)
+                rate_inputs = {}
+                for rate_col, (attribute, field) in zip(
+                    st.columns(len(machine_rates.ATTRIBUTE_FIELDS)), machine_rates.ATTRIBUTE_FIELDS.items(),
+                ):
+                    with rate_col:
+                        rate_inputs[field] = st.text_input(
+                            attribute, value=f"{sheet_attributes[field]:g}" if field in sheet_attributes else "",
+                            key=f"machine_{field}",
+                        )
+                rate_col6, rate_col7, rate_col8 = st.columns(3)
+                with rate_col6:
+                    rate_shifts = st.selectbox("Shifts", options=[None, 1, 2, 3], format_func=lambda shifts: "Each machine's" if shifts is None else str(shifts))
+                with rate_col7:
+                    rate_utilization = st.text_input("Utilization (blank: each machine's OEE)", value="")
+                with rate_col8:
+                    use_machine_mmr = st.checkbox("Cost the stages with these MMRs", value=False)
+                try:
+                    # Blank inputs fall back to the sheet's attributes
+                    machine_assumptions = machine_rates.rate_assumptions(
+                        master.machine_attributes,
+                        **{field: float(value) for field, value in rate_inputs.items() if value},
+                        shifts=rate_shifts, utilization=float(rate_utilization) if rate_utilization else None,
+                    )
+                except ValueError:
+                    st.error("Please enter valid numeric values for the machine-rate assumptions.")
+                except KeyError as e:
+                    st.error(f"Enter the machine-rate assumptions missing from the sheet: {e.args[0]}")
+                else:
+                    st.dataframe(machine_mmr.breakdown(machine_assumptions))
+                    st.dataframe(machine_mmr.mmr_matches(machine_assumptions))
+                    if use_machine_mmr:
+                        rate_assumptions = machine_assumptions
 
         # File uploader for Excel/CSV/XLSM files
         uploaded_file = st.file_uploader("Choose Process Mapping Excel/CSV/XLSM file", type=["xlsx", "csv", "xlsm"])
 
         if uploaded_file:
-            # Load data from the uploaded file
-            @st.cache_data
-            def load_data(file):
-                if file.name.endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file, sheet_name=None)
-                return df
-
-            df6 = load_data(uploaded_file)  # Load the Process Mapping data
+            # Open the uploaded workbook; sheets are parsed when they are first selected
+            uploaded_bytes = uploaded_file.getvalue()
+            process_map_digest = master_data.content_hash(uploaded_bytes)
+            df6 = load_data(process_map_digest, uploaded_bytes, uploaded_file.name)  # Load the Process Mapping data
 
             # Initialize session state to store edited data for each sheet
             if 'edited_sheets' not in st.session_state:
@@ -284,14 +581,22 @@ if new_analysis:
 
             processmapping_col1, processmapping_col2 = st.columns(2)
 
-            if isinstance(df6, dict):
+            if isinstance(df6, process_mapping.LazyWorkbook):
                 with processmapping_col1:
                     # Allow user to select a sheet
-                    sheet_name = st.selectbox("Select the sheet", df6.keys())
+                    sheet_name = st.selectbox("Select the sheet", df6.sheet_names)
 
+                placement_times = None
                 if sheet_name in df6:
-                    selected_data = df6[sheet_name]
+                    selected_data = df6.sheet(sheet_name, sheet_schema.PROCESS_MAPPING_SCHEMA)
                     st.session_state.df = pd.DataFrame(selected_data)  # Load original data from the selected sheet
+                    # SMT Placement cycle times estimated from a BOM stand in for the sheet's own
+                    placement_times = st.session_state.get('smt_placement_times', {}).get((process_map_digest, sheet_name))
+                    if placement_times:
+                        st.session_state.df = smt_placement.apply_placement_times(st.session_state.df, placement_times)[0]
+                    if not df6.issues[sheet_name].empty:
+                        with st.expander(f"{sheet_name}: {len(df6.issues[sheet_name])} problem(s) in the process mapping"):
+                            st.dataframe(df6.issues[sheet_name])
 
                     st.subheader("Data Table")
 
@@ -299,59 +604,99 @@ if new_analysis:
                 if 'MMR' not in df3.columns:
                     st.error("'MMR' column not found in 'MMR-EMS' sheet. Please check the input file.")
                 else:
-                    # Merge the data, keeping df5 (selected sheet) as left and matching with df3
-                    edited_data = st.session_state.df.merge(
-                        df3, left_on='Stage', right_on='Process Name', how='inner'
-                    )
-
-                    # Display only matching rows after the merge
-                    if edited_data.empty:
-                        st.warning("No matching content found between the Process Mapping and MMR-EMS datasets.")
-                    else:
-                        # Fill NaN values with 0
-                        edited_data.fillna(0, inplace=True)
-
-                    # Fill NaN values in 'MMR' with 0
-                    edited_data['MMR'] = edited_data['MMR'].fillna(0)
-
-                    # Add necessary columns with default values
-                    edited_data['VA MC Cost'] = np.nan
-                    edited_data['Batch Set up Cost'] = np.nan
-                    edited_data['Labour cost/Hr'] = np.nan
-
-                    # Calculate VA MC Cost
-                    edited_data['VA MC Cost'] = edited_data['Process Cycle Time'] * edited_data['MMR']
-                    edited_data['VA MC Cost'] = edited_data['VA MC Cost'].fillna(0)
-
                     try:
-                        labour_cost_hr = df4.loc[0, 'Labour cost/Hr']
-                        idl_cost_hr = df4.loc[0, 'Idl Cost/Hr']
-                        months_per_year = 12
-                        batch_qty = annual_volume / months_per_year if annual_volume > 0 else 1  # Avoid division by zero
-
-                        # Calculate Batch Set up Cost
-                        edited_data['Batch Set up Cost'] = (
-                            (((edited_data['Batch Set up Time'] * labour_cost_hr) / 3600) * 1.15) / batch_qty
-                        ) * edited_data['FTE for Batch Set up']
-                        
-                        # Calculate Labour Cost
-                        edited_data['Labour cost/Hr'] = (
-                            ((((edited_data['Process Cycle Time'] * labour_cost_hr) / 3600) * 1.15) * edited_data['DL FTE']) + 
-                            ((((edited_data['Process Cycle Time'] * idl_cost_hr) / 3600) * 1.15) * edited_data['IDL FTE'])
+                        # Match the stages with MMR-EMS through the index of this master-data revision; the
+                        # matched rows are cached per (process map, sheet, MMR-EMS and Stage Aliases content) and only costed here
+                        mmr_index = costing_mmr_index(master, rate_assumptions)
+                        merged_stages = shared_cache.CACHE.get_or_load(
+                            ('stage_merge', process_map_digest, sheet_name, sheet_versions(master, 'MMR-EMS', 'Stage Aliases'),
+                             tuple(sorted(placement_times.items())) if placement_times else None,
+                             rate_assumptions, sheet_versions(master, master_data.MACHINE_SHEET) if rate_assumptions else None),
+                            lambda: mmr_index.join(st.session_state.df),
                         )
-
-                        # Fill NaN values with 0
-                        edited_data['Batch Set up Cost'] = edited_data['Batch Set up Cost'].fillna(0)
-                        edited_data['Labour cost/Hr'] = edited_data['Labour cost/Hr'].fillna(0)
+                        edited_data = cost_engine.add_stage_costs(merged_stages, df4, annual_volume)
+
+                        # Display only matching rows after the merge
+                        if edited_data.empty:
+                            st.warning("No matching content found between the Process Mapping and MMR-EMS datasets.")
+
+                        # Stages costed on an approximate match, or left out, are listed rather than dropped silently
+                        match_report = mmr_index.match_report(st.session_state.df)
+                        if not match_report.empty:
+                            with st.expander(f"{sheet_name}: {len(match_report)} stage(s) matched approximately or not at all"):
+                                st.caption(
+                                    "'approximate' stages are costed with the process name shown; 'suggested' and 'unmatched' "
+                                    "stages are left out. Add an Alias / Process Name row to the 'Stage Aliases' sheet of "
+                                    "simulation_db.xlsx to map a stage name for good."
+                                )
+                                st.dataframe(match_report)
+                        if mmr_index.matcher.unknown_aliases:
+                            st.warning(
+                                "Stage Aliases pointing at process names MMR-EMS does not have: "
+                                + ", ".join(map(str, mmr_index.matcher.unknown_aliases))
+                            )
 
                         # Update session state
                         st.session_state.edited_sheets[sheet_name] = edited_data
 
                     except KeyError as e:
                         st.error(f"Error in calculation: Missing column {e}. Please check the input data.")
+                        st.stop()
                 # Display the updated DataFrame
                 st.data_editor(edited_data, key=f"data_editor_{sheet_name}_updated")
 
+                with st.expander("BOM"):
+                    package_catalog = load_package_catalog(master)
+                    if package_catalog is None:
+                        st.info("simulation_db.xlsx has no SMD_Package_Feeder_Master sheet to read a BOM against.")
+                    else:
+                        if placement_times:
+                            st.write(
+                                "SMT Placement cycle time from the BOM: "
+                                + ", ".join(f"{side} {seconds:,.2f} s" for side, seconds in placement_times.items())
+                            )
+                            if st.button("Use the sheet's SMT Placement cycle time"):
+                                st.session_state.smt_placement_times.pop((process_map_digest, sheet_name), None)
+                                st.rerun()
+                        st.caption(
+                            "Upload a BOM with a Package column; Quantity (parts per board), Side (Top/Bottom), Part "
+                            "Number, Mount (SMT/TH), Pins and Unit Price are optional. Through-hole parts are told by "
+                            "their package (DIP, TO-220, radial, ...) unless Mount says otherwise."
+                        )
+                        bom_file = st.file_uploader("Choose the BOM Excel/CSV file", type=["xlsx", "csv"], key='bom_file')
+                        if bom_file:
+                            try:
+                                bom_summary = load_bom(master, package_catalog, bom_file.getvalue(), bom_file.name)
+                            except (KeyError, ValueError) as e:
+                                st.error(f"The BOM could not be read: {e}")
+                            else:
+                                st.dataframe(bom_summary.sides)
+                                st.dataframe(bom_summary.feeders)
+                                if not bom_summary.unplaced.empty:
+                                    st.warning(
+                                        f"{len(bom_summary.unplaced)} BOM line(s) have a package that is neither "
+                                        "through-hole nor in SMD_Package_Feeder_Master and are left out of the SMT "
+                                        "placement and joints:"
+                                    )
+                                    st.dataframe(bom_summary.unplaced)
+
+                                bom_placement_col, bom_consumables_col = st.columns(2)
+                                with bom_placement_col:
+                                    if st.button("Use as the SMT Placement cycle time"):
+                                        bom_times = bom_summary.placement_times()
+                                        if smt_placement.apply_placement_times(st.session_state.df, bom_times)[1] == 0:
+                                            st.warning(f"{sheet_name} has no {smt_placement.PLACEMENT_STAGE} stage on the BOM's sides.")
+                                        else:
+                                            st.session_state.setdefault('smt_placement_times', {})[(process_map_digest, sheet_name)] = bom_times
+                                            st.rerun()
+                                with bom_consumables_col:
+                                    # Solder Joints count every SMT pad and through-hole barrel; Barrel Joints only the barrels
+                                    if st.button("Fill the solder joints and component cost"):
+                                        st.session_state['no_of_solder_joints'] = f"{bom_summary.total('Solder Joints'):g}"
+                                        st.session_state['barrel_joints'] = f"{bom_summary.total('TH Barrels'):g}"
+                                        st.session_state['cost_electronics_components'] = f"{bom_summary.total('Electronics Component ($)'):.4f}"
+                                        st.rerun()
+
                 st.header("Consumable Costing")
 
                 # Create one row with 4 columns for headings
@@ -546,7 +891,7 @@ if new_analysis:
                         # Input Fields
                         outer_dia_of_pad = st.text_input('Pad OD (mm)', value="", key="outer_dia_of_pad", disabled=False)
                         inner_dia_of_pad = st.text_input('Pad ID (mm)', value="", key="inner_dia_of_pad", disabled=False)
-                        no_of_solder_joints = st.text_input('Solder Joints', value="", key="no_of_solder_joints", disabled=False)
+                        no_of_solder_joints = st.text_input('Solder Joints', key="no_of_solder_joints", disabled=False)
                         thickness_of_solder = st.text_input('Solder Thick (mm)', value="0.6", key="thickness_of_solder", disabled=True)
 
                         try:
@@ -577,7 +922,7 @@ if new_analysis:
                         # Input Fields                  
                         barrel_dia = st.text_input('Barrel Dia(mm)', value="", key="barrel_dia", disabled=False)
                         board_thick = st.text_input('Board Thick(mm)', value="", key="board_thick", disabled=False)
-                        barrel_joints = st.text_input('Barrel Joints', value="", key="barrel_joints", disabled=False)
+                        barrel_joints = st.text_input('Barrel Joints', key="barrel_joints", disabled=False)
                         barrel_solder_thick = st.text_input('Barrel Solder Thick(mm)', value="", key="barrel_solder_thick", disabled=False)
 
                     solder_bar_cost_value = 0.024
@@ -631,7 +976,7 @@ if new_analysis:
                 with input_cost_col:
                     st.subheader("Input Cost")
                     cost_pcb = st.text_input('PCB ($)', value="", key="cost_pcb")
-                    cost_electronics_components = st.text_input('Electronics Component ($)', value="", key="cost_electronics_components")
+                    cost_electronics_components = st.text_input('Electronics Component ($)', key="cost_electronics_components")
                     cost_mech_components = st.text_input('Mechanical Component ($)', value="", key="cost_mech_components")
                     cost_nre = st.text_input('NRE ($)', value=nre_per_unit, key="cost_nre", disabled=True)
                     # cost_consumables_value = (rtv_cost_per_board + top_side_cost_per_board_value + bot_side_cost_per_board_value + flux_cost_per_board_value + solderbar_cost_per_brd)
@@ -654,12 +999,10 @@ if new_analysis:
 
                 with ohpandother_percentage_col:
                     st.subheader("OHP% Model Vs. Ann. Volume", )
-                    # Define the predefined percentages as a dictionary
-                    percentages = {
-                        "<100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1.5, "Profit on VA %": 8, "R&D %": 1, "Warranty %": 1, "SG&A %": 3},
-                        ">100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 2, "Warranty %": 1, "SG&A %": 2},
-                        "5K/10K": {"MOH %": 1, "FOH %": 20, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 3, "Warranty %": 1, "SG&A %": 4},
-                    }
+                    # Predefined percentages by annual volume
+                    percentages = cost_engine.OHP_PERCENTAGES
+                    # The numeric Annual Volume, before the name is reused for the volume band
+                    annual_volume_value = annual_volume
 
                     # Annual volume selection dropdown
                     annual_volume = st.selectbox("Select Annual Volume", options=["<100K", ">100K", "5K/10K"])
@@ -686,26 +1029,19 @@ if new_analysis:
                             # Show the value in a disabled text input
                             percentage_values[label] = cols[i].text_input(label, value=str(value), disabled=True)
 
-                    # Aggregate dummy data
-                    total_factory_overheads_batchsetup = sum(edited_data["Batch Set up Cost"])
-                    total_factory_overheads_vamachine = sum(edited_data["VA MC Cost"])
-                    total_factory_overheads_labour = sum(edited_data["Labour cost/Hr"])
-
-                    # Convert percentages to fractions and compute costs
+                    # OH&P rollup of the costed stages, shared with Cost All Sheets
                     pcb_comp_mech_cost = cost_pcb + cost_electronics_components + cost_mech_components
-
-                    moh_cost_value = pcb_comp_mech_cost * (selected_percentages["MOH %"] / 100)
-                    foh_cost_value = (total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour) * (selected_percentages["FOH %"] / 100)
-                    profit_on_rm_cost_value = pcb_comp_mech_cost * (selected_percentages["Profit on RM %"] / 100)
-                    profit_on_va_cost_value = (total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour) * (selected_percentages["Profit on VA %"] / 100)
-
-                    total_material_cost_value = pcb_comp_mech_cost + nre_per_unit
-                    total_manufacturing_cost_value = total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour
-                    total_ohp_cost_value = moh_cost_value + foh_cost_value + profit_on_rm_cost_value + profit_on_va_cost_value
-
-                    r_n_d_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["R&D %"] / 100)
-                    warranty_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["Warranty %"] / 100)
-                    sg_and_a_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["SG&A %"] / 100)
+                    rollup = cost_engine.cost_rollup(edited_data, pcb_comp_mech_cost, nre_per_unit, selected_percentages)
+                    moh_cost_value = rollup['MOH ($)']
+                    foh_cost_value = rollup['FOH ($)']
+                    profit_on_rm_cost_value = rollup['Profit on RM ($)']
+                    profit_on_va_cost_value = rollup['Profit on VA ($)']
+                    total_material_cost_value = rollup['Material Cost ($)']
+                    total_manufacturing_cost_value = rollup['Manufacturing Cost ($)']
+                    total_ohp_cost_value = rollup['OH&P ($)']
+                    r_n_d_cost_value = rollup['R&D ($)']
+                    warranty_cost_value = rollup['Warranty ($)']
+                    sg_and_a_cost_value = rollup['SG&A ($)']
 
                 with ohpandother_cost_col:
                     st.subheader("Cost Computation")
@@ -726,15 +1062,13 @@ if new_analysis:
 
                 with placeholder2_col:
                     st.subheader("Cost Summary")
-                    grand_total_cost_value = ((total_material_cost_value + total_manufacturing_cost_value) + moh_cost_value + 
-                                                    foh_cost_value + profit_on_rm_cost_value + profit_on_va_cost_value +
-                                                    r_n_d_cost_value + warranty_cost_value + sg_and_a_cost_value )
+                    grand_total_cost_value = rollup['Total Cost ($)']
                     st.text_input('Total Cost ($)', value=grand_total_cost_value, disabled=True)
 
-                    rm_cost_value = total_material_cost_value
+                    rm_cost_value = rollup['RM Cost ($)']
                     st.text_input('RM Cost ($)', value=rm_cost_value, disabled=True)
 
-                    conversion_cost_value = grand_total_cost_value - total_material_cost_value
+                    conversion_cost_value = rollup['Conversion Cost ($)']
                     st.text_input('Conversion Cost ($)', value=conversion_cost_value, disabled=True)
 
                     if st.button("Save Consumable, RM & Conversion Costing Details"):
@@ -841,6 +1175,217 @@ if new_analysis:
                         else:
                             st.error("No data available to save Consumable, RM & Conversion Costing Details.")
                 
+                with st.expander("Cost All Sheets"):
+                    st.write("Runs the stage costing and the OH&P rollup above for every sheet of the process-mapping workbook, with the same input costs and percentages.")
+                    cost_workers = st.selectbox(
+                        "Worker Processes", options=list(range(1, (os.cpu_count() or 1) + 1)),
+                        help="1 costs the sheets in this process. Starting worker processes takes a few seconds, so more only pays off for workbooks with thousands of sheets.",
+                    )
+                    if st.button("Cost All Sheets"):
+                        with st.spinner("Costing every sheet..."):
+                            all_sheets = dict(df6.sheets(df6.sheet_names, sheet_schema.PROCESS_MAPPING_SCHEMA))
+                            # BOM placement times saved for a sheet stand in for its own, as for the selected sheet above
+                            for (placement_digest, placement_sheet), placement_times in st.session_state.get('smt_placement_times', {}).items():
+                                if placement_digest == process_map_digest and placement_sheet in all_sheets:
+                                    all_sheets[placement_sheet] = smt_placement.apply_placement_times(all_sheets[placement_sheet], placement_times)[0]
+                            # Kept with the workbook it belongs to, so another upload does not show stale results
+                            st.session_state.all_sheet_costs = (process_map_digest, cost_engine.cost_all_sheets(
+                                all_sheets, costing_mmr_index(master, rate_assumptions),
+                                df4, annual_volume_value, pcb_comp_mech_cost, nre_per_unit,
+                                selected_percentages, cost_consumables, max_workers=cost_workers,
+                            ))
+
+                    costed_digest, all_sheet_costs = st.session_state.get('all_sheet_costs', (None, None))
+                    if costed_digest == process_map_digest:
+                        if 'Error' in all_sheet_costs.columns:
+                            for failed_sheet, error in all_sheet_costs['Error'].dropna().items():
+                                st.warning(f"{failed_sheet}: could not be costed ({error}).")
+                            all_sheet_costs = all_sheet_costs[all_sheet_costs['Error'].isna()].drop(columns='Error')
+                        st.dataframe(all_sheet_costs)
+
+                        cost_components = ['Batch Set up Cost ($)', 'VA MC Cost ($)', 'Labour Cost ($)', 'OH&P ($)', 'R&D ($)', 'Warranty ($)', 'SG&A ($)']
+                        component_chart = px.bar(
+                            all_sheet_costs.reset_index(), x='Sheet', y=cost_components,
+                            title="Cost Components by Sheet", labels={'value': 'Cost ($)', 'variable': 'Component'},
+                        )
+                        st.plotly_chart(component_chart, use_container_width=True)
+
+                        summary_chart = px.bar(
+                            all_sheet_costs.reset_index(), x='Sheet', y=['RM Cost ($)', 'Conversion Cost ($)'], barmode='group',
+                            title="RM vs. Conversion Cost by Sheet", labels={'value': 'Cost ($)', 'variable': 'Cost'},
+                        )
+                        st.plotly_chart(summary_chart, use_container_width=True)
+
+                with st.expander("Capacity Plan"):
+                    st.write(
+                        f"Hours, lines and shifts each stage needs for a year, at {hr_year_shift:,.0f} h per shift "
+                        f"(Hr/Year, 1 shift) and {overall_labor_efficiency:.0%} labour efficiency."
+                    )
+                    capacity_col1, capacity_col2 = st.columns(2)
+                    with capacity_col1:
+                        capacity_volumes = st.text_input(
+                            'Capacity Scenarios (Annual Volumes)', value=f"{annual_volume_value:g}" if annual_volume_value else "",
+                        )
+                    with capacity_col2:
+                        capacity_products = st.selectbox(
+                            "Products", options=["Selected sheet", "Every sheet, each at the scenario volume"],
+                        )
+                    try:
+                        capacity_volumes = nre.parse_number_list(capacity_volumes)
+                    except ValueError:
+                        capacity_volumes = []
+                        st.warning("Enter the annual volumes as numbers, e.g. 20000, 50k, 100k.")
+
+                    if capacity_volumes and st.button("Plan Capacity"):
+                        try:
+                            if capacity_products == "Selected sheet":
+                                routings = {sheet_name: st.session_state.df}
+                            else:
+                                routings = df6.sheets(df6.sheet_names, sheet_schema.PROCESS_MAPPING_SCHEMA)
+                            with st.spinner("Planning capacity..."):
+                                capacity_model = capacity.CapacityModel(routings)
+                                capacity_plan = capacity_model.plan(
+                                    capacity.volume_scenarios(capacity_volumes, capacity_model.products),
+                                    line_simulation.ShiftCalendar(shift_hr_day, days_week, weeks_year, overall_labor_efficiency),
+                                    scenarios=[f"{volume:,.0f}" for volume in capacity_volumes],
+                                )
+                        except (KeyError, ValueError) as e:
+                            st.error(f"Cannot plan capacity: {e}")
+                        else:
+                            # Kept with the workbook and products it was planned for, like the simulation below
+                            st.session_state.capacity_plan = ((process_map_digest, sheet_name, capacity_products), capacity_plan)
+
+                    planned_for, capacity_plan = st.session_state.get('capacity_plan', (None, None))
+                    if planned_for == (process_map_digest, sheet_name, capacity_products):
+                        st.dataframe(capacity.scenario_summary(capacity_plan))
+                        capacity_flagged = capacity.flagged(capacity_plan)
+                        if not capacity_flagged.empty:
+                            st.warning(f"{len(capacity_flagged)} stage(s) need a second shift or line:")
+                            st.dataframe(capacity_flagged)
+                        st.dataframe(capacity_plan)
+                        capacity_chart = px.bar(
+                            capacity_plan, x='Stage', y='Utilization %', color='Scenario', barmode='group',
+                            hover_data=['Lines', 'Shifts/Line', 'Hours Needed'], title="Stage Utilization by Scenario",
+                        )
+                        st.plotly_chart(capacity_chart, use_container_width=True)
+
+                with st.expander("Line Simulation"):
+                    st.write(
+                        "Simulates the selected sheet's stages as a line, one station per side or per stage, with batch "
+                        "set-ups, buffers between stations and the Process_CT shift calendar and labour efficiency."
+                    )
+                    sim_col1, sim_col2, sim_col3, sim_col4 = st.columns(4)
+                    with sim_col1:
+                        sim_stations = st.selectbox("Stations", options=["Line sides", "Individual stages"])
+                    with sim_col2:
+                        sim_boards = st.text_input('Boards to Simulate', value=str(int(annual_volume_value)) if annual_volume_value else "")
+                    with sim_col3:
+                        sim_buffer = st.text_input('Buffer between Stations (boards)', value=str(line_simulation.BUFFER_BOARDS))
+                    with sim_col4:
+                        sim_cv = st.text_input('Cycle Time Variation (CV)', value="0")
+
+                    if st.button("Run Simulation"):
+                        try:
+                            sim_boards = int(float(sim_boards)) if sim_boards else 0
+                            sim_buffer = float(sim_buffer) if sim_buffer else float('inf')
+                            sim_cv = float(sim_cv) if sim_cv else 0.0
+                            stations = line_simulation.line_stations(st.session_state.df, by_stage=sim_stations == "Individual stages")
+                            calendar = line_simulation.ShiftCalendar(shift_hr_day, days_week, weeks_year, overall_labor_efficiency)
+                            with st.spinner("Simulating the line..."):
+                                st.session_state.line_simulation = (process_map_digest, sheet_name, line_simulation.simulate_line(
+                                    stations, sim_boards, cost_engine.batch_quantity(annual_volume_value), calendar,
+                                    buffers=sim_buffer, cv=sim_cv,
+                                ))
+                        except ValueError as e:
+                            st.error(f"Cannot simulate the line: {e}")
+                        except KeyError as e:
+                            st.error(f"Cannot simulate the line: missing column {e}.")
+
+                    simulated_digest, simulated_sheet, simulation = st.session_state.get('line_simulation', (None, None, None))
+                    if (simulated_digest, simulated_sheet) == (process_map_digest, sheet_name):
+                        simulation_summary, simulation_stations = simulation
+                        st.dataframe(pd.DataFrame({
+                            'Result': list(simulation_summary),
+                            'Value': [value if isinstance(value, str) else f"{value:,.2f}" for value in simulation_summary.values()],
+                        }))
+                        st.dataframe(simulation_stations)
+                        station_chart = px.bar(
+                            simulation_stations, x='Station', y=['Utilization %', 'Blocked %', 'Idle %'],
+                            title="Station Time", labels={'value': '% of makespan', 'variable': ''},
+                        )
+                        st.plotly_chart(station_chart, use_container_width=True)
+
+                with st.expander("Line Balancing"):
+                    st.write(
+                        "Assigns the selected sheet's stages to stations, in side order (SMT-Top, SMT-Bottom, Manual/TH "
+                        "Line, Testing/Box Build), against the line laid out as one station per side."
+                    )
+                    balance_calendar = line_simulation.ShiftCalendar(shift_hr_day, days_week, weeks_year, overall_labor_efficiency)
+                    balance_col1, balance_col2, balance_col3, balance_col4 = st.columns(4)
+                    with balance_col1:
+                        balance_shifts = st.selectbox("Shifts/Day", options=list(range(1, capacity.max_shifts(balance_calendar) + 1)))
+                    with balance_col2:
+                        balance_stations = st.text_input('Stations (blank: fewest for the takt time)', value="")
+                    with balance_col3:
+                        balance_keep_order = st.checkbox("Keep the sheet order within each side", value=True)
+                    with balance_col4:
+                        balance_exact = st.checkbox("Exact search", value=False)
+
+                    if not balance_stations and not annual_volume_value:
+                        st.info("Enter the Annual Volume above, or a number of stations, to balance the line.")
+                    elif st.button("Balance Line"):
+                        try:
+                            if balance_stations:
+                                balance_takt = None
+                                balance_assignment, balance_table, balance_proven = line_balancing.balance_line(
+                                    st.session_state.df, n_stations=int(float(balance_stations)),
+                                    keep_sheet_order=balance_keep_order, exact=balance_exact,
+                                )
+                            else:
+                                balance_takt = line_balancing.takt_time(annual_volume_value, balance_calendar, balance_shifts)
+                                balance_assignment, balance_table, balance_proven = line_balancing.balance_line(
+                                    st.session_state.df, cycle_time=balance_takt,
+                                    keep_sheet_order=balance_keep_order, exact=balance_exact,
+                                )
+                            labour_cost_hr = df4['Labour cost/Hr'].iloc[0]
+                            balance_metrics = {
+                                'Current (one station per side)': line_balancing.line_metrics(
+                                    line_balancing.side_stations(st.session_state.df), labour_cost_hr, balance_calendar,
+                                ),
+                                'Balanced': line_balancing.line_metrics(balance_table, labour_cost_hr, balance_calendar),
+                            }
+                        except ValueError as e:
+                            st.error(f"Cannot balance the line: {e}")
+                        except KeyError as e:
+                            st.error(f"Cannot balance the line: missing column {e}.")
+                        else:
+                            st.session_state.line_balance = (process_map_digest, sheet_name, (
+                                balance_takt, annual_volume_value, balance_assignment, balance_table, balance_proven, balance_metrics,
+                            ))
+
+                    balanced_digest, balanced_sheet, line_balance = st.session_state.get('line_balance', (None, None, None))
+                    if (balanced_digest, balanced_sheet) == (process_map_digest, sheet_name):
+                        balance_takt, balance_volume, balance_assignment, balance_table, balance_proven, balance_metrics = line_balance
+                        if balance_takt is not None:
+                            st.write(f"Takt time: {balance_takt:,.1f} s per board at {balance_volume:,.0f} boards a year.")
+                        if not balance_proven:
+                            st.info(
+                                "The station count is the best found within the search limit; it may not be the fewest possible."
+                            )
+                        st.dataframe(pd.DataFrame({
+                            layout: {name: f"{value:,.2f}" for name, value in metrics.items()}
+                            for layout, metrics in balance_metrics.items()
+                        }))
+                        st.dataframe(balance_table)
+                        st.dataframe(balance_assignment)
+                        balance_chart = px.bar(
+                            balance_table, x='Station', y='Station Time (s)', hover_data=['Operations', 'Parallel'],
+                            title="Station Time",
+                        )
+                        if balance_takt is not None:
+                            balance_chart.add_hline(y=balance_takt, line_dash="dash", annotation_text="Takt time")
+                        st.plotly_chart(balance_chart, use_container_width=True)
+
                 # Update the data editor with the latest data
                 edited_data2 = st.session_state.edited_sheets.get(sheet_name, pd.DataFrame())
 
@@ -953,16 +1498,9 @@ if existing_analysis:
         uploaded_file = st.file_uploader("Choose NRE Costing Excel/CSV/XLSM file", type=["xlsx", "csv", "xlsm"])
 
         if uploaded_file:
-            # Load data from the uploaded file
-            @st.cache_data
-            def load_data(file):
-                if file.name.endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file, sheet_name=None)
-                return df
-
-            df7 = load_data(uploaded_file)  # Load the Process Mapping data
+            # Open the uploaded workbook; sheets are parsed when they are first selected
+            uploaded_bytes = uploaded_file.getvalue()
+            df7 = load_data(master_data.content_hash(uploaded_bytes), uploaded_bytes, uploaded_file.name)  # Load the Process Mapping data
 
             # Initialize session state to store edited data for each sheet
             if 'edited_sheets' not in st.session_state:
@@ -970,13 +1508,13 @@ if existing_analysis:
 
             processmapping_col1, _ = st.columns(2)
 
-            if isinstance(df7, dict):
+            if isinstance(df7, process_mapping.LazyWorkbook):
                 with processmapping_col1:
                     # Allow user to select a sheet
-                    sheet_name = st.selectbox("Select the relavant NRE sheet", df7.keys())
+                    sheet_name = st.selectbox("Select the relavant NRE sheet", df7.sheet_names)
 
                 if sheet_name in df7:
-                    nre_selected_data = df7[sheet_name]
+                    nre_selected_data = df7.sheet(sheet_name)
                     st.session_state.df = pd.DataFrame(nre_selected_data)  # Load original data from the selected sheet
 
         st.subheader("NRE Costing Data Table")
@@ -988,16 +1526,9 @@ if existing_analysis:
         uploaded_file = st.file_uploader("Choose Should Costing Excel/CSV/XLSM file", type=["xlsx", "csv", "xlsm"])
 
         if uploaded_file:
-            # Load data from the uploaded file
-            @st.cache_data
-            def load_data(file):
-                if file.name.endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file, sheet_name=None)
-                return df
-
-            df8 = load_data(uploaded_file)  # Load the Process Mapping data
+            # Open the uploaded workbook; sheets are parsed when they are first selected
+            uploaded_bytes = uploaded_file.getvalue()
+            df8 = load_data(master_data.content_hash(uploaded_bytes), uploaded_bytes, uploaded_file.name)  # Load the Process Mapping data
 
             # Initialize session state to store edited data for each sheet
             if 'edited_sheets' not in st.session_state:
@@ -1005,13 +1536,13 @@ if existing_analysis:
 
             processmapping_col2, _ = st.columns(2)
 
-            if isinstance(df8, dict):
+            if isinstance(df8, process_mapping.LazyWorkbook):
                 with processmapping_col2:
                     # Allow user to select a sheet
-                    sheet_name = st.selectbox("Select the relavant Should Costing sheet", df8.keys())
+                    sheet_name = st.selectbox("Select the relavant Should Costing sheet", df8.sheet_names)
 
                 if sheet_name in df8:
-                    selected_data = df8[sheet_name]
+                    selected_data = df8.sheet(sheet_name)
                     st.session_state.df = pd.DataFrame(selected_data)  # Load original data from the selected sheet
 
         st.subheader("Should Costing Data Table")
@@ -1214,7 +1745,7 @@ if existing_analysis:
             # Input Fields
             outer_dia_of_pad = st.text_input('Pad OD (mm)', value="", key="outer_dia_of_pad", disabled=False)
             inner_dia_of_pad = st.text_input('Pad ID (mm)', value="", key="inner_dia_of_pad", disabled=False)
-            no_of_solder_joints = st.text_input('Solder Joints', value="", key="no_of_solder_joints", disabled=False)
+            no_of_solder_joints = st.text_input('Solder Joints', key="no_of_solder_joints", disabled=False)
             thickness_of_solder = st.text_input('Solder Thick (mm)', value="0.6", key="thickness_of_solder", disabled=True)
 
             try:
@@ -1245,7 +1776,7 @@ if existing_analysis:
             # Input Fields                  
             barrel_dia = st.text_input('Barrel Dia(mm)', value="", key="barrel_dia", disabled=False)
             board_thick = st.text_input('Board Thick(mm)', value="", key="board_thick", disabled=False)
-            barrel_joints = st.text_input('Barrel Joints', value="", key="barrel_joints", disabled=False)
+            barrel_joints = st.text_input('Barrel Joints', key="barrel_joints", disabled=False)
             barrel_solder_thick = st.text_input('Barrel Solder Thick(mm)', value="", key="barrel_solder_thick", disabled=False)
 
         solder_bar_cost_value = 0.024
@@ -1289,7 +1820,15 @@ if existing_analysis:
             solder_bar_cost = st.text_input('Solder Bar Cost($/g)', value=solder_bar_cost_value, key="solder_bar_cost", disabled=True)
             st.text_input('Solder Bar Cost/Brd($)', value=f"{solderbar_cost_per_brd:.2f}", key="solderbar_cost_per_brd", disabled=True) 
 
-        nre_per_unit = nre_selected_data.at[0, "NRE Per Unit ($)"]
+        if (
+            "NRE Per Unit ($)" not in nre_selected_data.columns
+            and isinstance(df7, process_mapping.LazyWorkbook) and export.NRE_SUMMARY_SHEET in df7
+        ):
+            # Newer NRE exports keep the summary values on their own sheet
+            nre_summary = df7.sheet(export.NRE_SUMMARY_SHEET).set_index('Parameter')['Value']
+            nre_per_unit = nre_summary["NRE Per Unit ($)"]
+        else:
+            nre_per_unit = nre_selected_data.at[0, "NRE Per Unit ($)"]
 
 
     st.header("RM & Conversion Cost Summary")                
@@ -1299,7 +1838,7 @@ if existing_analysis:
     with input_cost_col:
         st.subheader("Input Cost")
         cost_pcb = st.text_input('PCB ($)', value="", key="cost_pcb")
-        cost_electronics_components = st.text_input('Electronics Component ($)', value="", key="cost_electronics_components")
+        cost_electronics_components = st.text_input('Electronics Component ($)', key="cost_electronics_components")
         cost_mech_components = st.text_input('Mechanical Component ($)', value="", key="cost_mech_components")
         cost_nre = st.text_input('NRE ($)', value=nre_per_unit, key="cost_nre", disabled=True)
         cost_consumables_value = (rtv_cost_per_board + top_side_cost_per_board_value + bot_side_cost_per_board_value + flux_cost_per_board_value)
@@ -1322,12 +1861,8 @@ if existing_analysis:
 
     with ohpandother_percentage_col:
         st.subheader("OHP% Model Vs. Ann. Volume", )
-        # Define the predefined percentages as a dictionary
-        percentages = {
-            "<100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1.5, "Profit on VA %": 8, "R&D %": 1, "Warranty %": 1, "SG&A %": 3},
-            ">100K": {"MOH %": 1, "FOH %": 12.5, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 2, "Warranty %": 1, "SG&A %": 2},
-            "5K/10K": {"MOH %": 1, "FOH %": 20, "Profit on RM %": 1, "Profit on VA %": 8, "R&D %": 3, "Warranty %": 1, "SG&A %": 4},
-        }
+        # Predefined percentages by annual volume
+        percentages = cost_engine.OHP_PERCENTAGES
 
         # Annual volume selection dropdown
         annual_volume = st.selectbox("Select Annual Volume", options=["<100K", ">100K", "5K/10K"])
@@ -1354,26 +1889,19 @@ if existing_analysis:
                 # Show the value in a disabled text input
                 percentage_values[label] = cols[i].text_input(label, value=str(value), disabled=True)
 
-        # Aggregate dummy data
-        total_factory_overheads_batchsetup = sum(selected_data["Batch Set up Cost"])
-        total_factory_overheads_vamachine = sum(selected_data["VA MC Cost"])
-        total_factory_overheads_labour = sum(selected_data["Labour cost/Hr"])
-
-        # Convert percentages to fractions and compute costs
+        # OH&P rollup of the costed stages, shared with Cost All Sheets
         pcb_comp_mech_cost = cost_pcb + cost_electronics_components + cost_mech_components
-
-        moh_cost_value = pcb_comp_mech_cost * (selected_percentages["MOH %"] / 100)
-        foh_cost_value = (total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour) * (selected_percentages["FOH %"] / 100)
-        profit_on_rm_cost_value = pcb_comp_mech_cost * (selected_percentages["Profit on RM %"] / 100)
-        profit_on_va_cost_value = (total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour) * (selected_percentages["Profit on VA %"] / 100)
-
-        total_material_cost_value = pcb_comp_mech_cost + nre_per_unit
-        total_manufacturing_cost_value = total_factory_overheads_batchsetup + total_factory_overheads_vamachine + total_factory_overheads_labour
-        total_ohp_cost_value = moh_cost_value + foh_cost_value + profit_on_rm_cost_value + profit_on_va_cost_value
-
-        r_n_d_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["R&D %"] / 100)
-        warranty_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["Warranty %"] / 100)
-        sg_and_a_cost_value = (total_material_cost_value + total_manufacturing_cost_value) * (selected_percentages["SG&A %"] / 100)
+        rollup = cost_engine.cost_rollup(selected_data, pcb_comp_mech_cost, nre_per_unit, selected_percentages)
+        moh_cost_value = rollup['MOH ($)']
+        foh_cost_value = rollup['FOH ($)']
+        profit_on_rm_cost_value = rollup['Profit on RM ($)']
+        profit_on_va_cost_value = rollup['Profit on VA ($)']
+        total_material_cost_value = rollup['Material Cost ($)']
+        total_manufacturing_cost_value = rollup['Manufacturing Cost ($)']
+        total_ohp_cost_value = rollup['OH&P ($)']
+        r_n_d_cost_value = rollup['R&D ($)']
+        warranty_cost_value = rollup['Warranty ($)']
+        sg_and_a_cost_value = rollup['SG&A ($)']
 
     with ohpandother_cost_col:
         st.subheader("Cost Computation")
@@ -1394,15 +1922,13 @@ if existing_analysis:
 
     with placeholder2_col:
         st.subheader("Cost Summary")
-        grand_total_cost_value = ((total_material_cost_value + total_manufacturing_cost_value) + moh_cost_value + 
-                                        foh_cost_value + profit_on_rm_cost_value + profit_on_va_cost_value +
-                                        r_n_d_cost_value + warranty_cost_value + sg_and_a_cost_value )
+        grand_total_cost_value = rollup['Total Cost ($)']
         st.text_input('Total Cost ($)', value=grand_total_cost_value, disabled=True)
 
-        rm_cost_value = total_material_cost_value
+        rm_cost_value = rollup['RM Cost ($)']
         st.text_input('RM Cost ($)', value=rm_cost_value, disabled=True)
 
-        conversion_cost_value = grand_total_cost_value - total_material_cost_value
+        conversion_cost_value = rollup['Conversion Cost ($)']
         st.text_input('Conversion Cost ($)', value=conversion_cost_value, disabled=True)
 
         if st.button("Save Consumable, RM & Conversion Costing Details"):
@@ -0,0 +1,62 @@
+import io
+import re
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# Sheet of an NRE export holding the volume and summary parameters
+NRE_SUMMARY_SHEET = 'NRE Summary'
+
+# Rows converted to Python values at a time, so memory stays flat however long the sheet is
+CHUNK_ROWS = 5_000
+
+
+def sheet_title(name):
+    # Excel sheet names: at most 31 characters, none of []:*?/\
+    return re.sub(r'[\[\]:*?/\\]', '_', str(name))[:31] or 'Sheet'
+
+
+def write_workbook(sheets):
+    """Write {sheet name: DataFrame} to .xlsx bytes with openpyxl's streaming write-only mode.
+
+    Rows are appended chunk by chunk and never kept as cells, so export time and
+    peak memory grow with the data itself rather than with openpyxl's cell objects.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, frame in sheets.items():
+        worksheet = workbook.create_sheet(sheet_title(name))
+        worksheet.append([str(column) for column in frame.columns])
+        for start in range(0, len(frame), CHUNK_ROWS):
+            for row in _cell_values(frame.iloc[start:start + CHUNK_ROWS]):
+                worksheet.append(row)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+def _cell_values(chunk):
+    # Blank cells for NaN; numpy scalars become Python numbers
+    values = chunk.astype(object).where(chunk.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        yield [value.item() if isinstance(value, np.generic) else value for value in row]
+
+
+def nre_workbook(nre_lines, parameters, sheet_name='NRE', costing=None):
+    """NRE export: the lines on one sheet, the volume and summary parameters on NRE_SUMMARY_SHEET.
+
+    ``parameters`` maps parameter names to values; ``costing`` optionally adds
+    {sheet name: DataFrame} process-costing sheets. Raises ValueError when ``sheet_name``
+    is the summary sheet's name.
+    """
+    # Excel sheet names are case-insensitive
+    if sheet_title(sheet_name).casefold() == NRE_SUMMARY_SHEET.casefold():
+        raise ValueError(f"The NRE lines cannot be saved on the '{NRE_SUMMARY_SHEET}' sheet; choose another sheet name.")
+    sheets = {
+        sheet_name: nre_lines,
+        NRE_SUMMARY_SHEET: pd.DataFrame({'Parameter': list(parameters), 'Value': list(parameters.values())}),
+    }
+    for name, frame in (costing or {}).items():
+        sheets[f'Costing {name}'] = frame
+    return write_workbook(sheets)
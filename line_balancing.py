@@ -0,0 +1,310 @@
+import bisect
+import math
+
+import numpy as np
+import pandas as pd
+
+import cost_engine
+import line_simulation
+
+# Search nodes the exact mode visits, over all its searches, before settling for the best
+# assignment found so far
+NODE_LIMIT = 20_000
+
+# Seconds to which the lowest cycle time that fits a number of stations is searched
+CYCLE_TIME_TOLERANCE = 0.01
+
+ASSIGNMENT_COLUMNS = ['Station', 'Side', 'Stage', 'Process Cycle Time']
+STATION_COLUMNS = ['Station', 'Operations', 'Parallel', 'Station Time (s)']
+
+# Slack for comparing sums of cycle times against a cycle time
+EPSILON = 1e-9
+
+
+def takt_time(annual_volume, calendar, shifts=1):
+    # Effective working seconds available per board
+    if annual_volume <= 0:
+        raise ValueError('Annual Volume must be positive to work out a takt time')
+    efficiency = calendar.efficiency if calendar.efficiency > 0 else 1.0
+    return calendar.hours_per_year() * shifts * cost_engine.SECONDS_PER_HOUR * efficiency / annual_volume
+
+
+def operations(process_map, keep_sheet_order=True):
+    """Operations of a process map in line order, with the predecessors of each.
+
+    Every operation of a side follows every operation of the side before it
+    (SMT-Top, SMT-Bottom, Manual/TH Line, Testing/Box Build); with
+    ``keep_sheet_order`` the operations of a side also keep their sheet order.
+    Predecessors always come earlier in the list.
+    """
+    stages, sides = line_simulation.line_order(process_map)
+    ops = pd.DataFrame({
+        'Side': sides.to_numpy(),
+        'Stage': stages['Stage'].to_numpy(),
+        'Process Cycle Time': stages['Process Cycle Time'].to_numpy(dtype=np.float64),
+    })
+    if keep_sheet_order:
+        return ops, [[i - 1] if i else [] for i in range(len(ops))]
+
+    side_codes = pd.factorize(ops['Side'])[0]
+    side_members = [np.flatnonzero(side_codes == code).tolist() for code in range(side_codes.max() + 1 if len(ops) else 0)]
+    return ops, [side_members[code - 1] if code else [] for code in side_codes]
+
+
+class _Problem:
+    # Times, precedence and ranked positional weights of one balancing problem
+
+    def __init__(self, times, predecessors):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.n = len(self.times)
+        self.predecessors = predecessors
+        self.successors = [[] for _ in range(self.n)]
+        for i, preds in enumerate(predecessors):
+            for p in preds:
+                self.successors[p].append(i)
+        self.is_chain = all(list(preds) == ([i - 1] if i else []) for i, preds in enumerate(predecessors))
+
+        # Positional weight: an operation's time plus that of everything after it
+        reach = np.zeros((self.n, self.n), dtype=bool)
+        for i in range(self.n - 1, -1, -1):
+            for j in self.successors[i]:
+                reach[i] |= reach[j]
+                reach[i, j] = True
+        self.weights = self.times + reach.astype(np.float64) @ self.times
+        self.rank = np.argsort(-self.weights, kind='stable')
+        self.rank_of = np.argsort(self.rank)
+        self.pred_masks = [sum(1 << p for p in preds) for preds in predecessors]
+
+
+def _effective_times(problem, cycle_time):
+    # Operations longer than the cycle time run on parallel copies of a station and fill each copy
+    parallel = np.maximum(np.ceil(problem.times / cycle_time - EPSILON), 1).astype(np.int64)
+    return np.where(parallel > 1, cycle_time, problem.times), parallel
+
+
+def _heuristic(problem, effective, cycle_time):
+    # Ranked positional weight: fill each station with the heaviest operation that is free and fits
+    station_of = np.full(problem.n, -1, dtype=np.int64)
+    waiting = [len(preds) for preds in problem.predecessors]
+    rank_of = problem.rank_of.tolist()
+    times = effective.tolist()
+    # Ranks of the operations whose predecessors are all assigned, heaviest first
+    free = sorted(rank_of[i] for i in range(problem.n) if not waiting[i])
+    station, load = 0, 0.0
+    for _ in range(problem.n):
+        fitting = next((r for r in free if load + times[problem.rank[r]] <= cycle_time + EPSILON), None)
+        if fitting is None:
+            station, load = station + 1, 0.0
+            fitting = free[0]
+        free.remove(fitting)
+        i = problem.rank[fitting]
+        station_of[i] = station
+        load += times[i]
+        for j in problem.successors[i]:
+            waiting[j] -= 1
+            if not waiting[j]:
+                bisect.insort(free, rank_of[j])
+    return station_of
+
+
+def _exact(problem, effective, cycle_time, best, budget):
+    """Station-oriented branch and bound over maximal station loads.
+
+    Starts from the heuristic's assignment ``best`` and returns (assignment, proven
+    optimal). ``budget`` is a one-item list of the nodes left to visit, shared by the
+    searches of one balance.
+    """
+    full = (1 << problem.n) - 1
+    best_count = best.max() + 1
+    best = best.copy()
+    seen = {}
+    total = float(effective.sum())
+    times = effective.tolist()
+    rank = problem.rank.tolist()
+    pred_masks = problem.pred_masks
+
+    def lower_bound(assigned_time):
+        return math.ceil((total - assigned_time) / cycle_time - EPSILON)
+
+    def loads(mask):
+        # Maximal sets of free operations that fit one station, heaviest first; building
+        # a set counts against the node limit too, wide layers having a great many
+        found = []
+        # Operations that could share the station: those fitting it together with their
+        # unassigned predecessors, which must be able to share it too
+        open_ops = 0
+        for i in range(problem.n):
+            if mask >> i & 1 or problem.pred_masks[i] & ~(mask | open_ops):
+                continue
+            needed = times[i] + sum(times[p] for p in problem.predecessors[i] if not mask >> p & 1)
+            if needed <= cycle_time + EPSILON:
+                open_ops |= 1 << i
+        candidates = [i for i in rank if open_ops >> i & 1]
+        shortest = min((times[i] for i in candidates), default=0.0)
+
+        def fits(i, load_mask, time):
+            return not load_mask >> i & 1 and not pred_masks[i] & ~(mask | load_mask) and time + times[i] <= cycle_time + EPSILON
+
+        # Each set is built once, adding operations in rank order; predecessors outrank
+        # their successors, so an operation freed by the set is still to come
+        def extend(start, load_mask, time):
+            budget[0] -= 1
+            if budget[0] < 0:
+                return
+            extended = False
+            for k in range(start, len(candidates)):
+                i = candidates[k]
+                if fits(i, load_mask, time):
+                    extended = True
+                    extend(k + 1, load_mask | 1 << i, time + times[i])
+            if extended or not load_mask:
+                return
+            if time + shortest > cycle_time + EPSILON or not any(fits(i, load_mask, time) for i in candidates[:start]):
+                found.append((time, load_mask))
+
+        extend(0, 0, 0.0)
+        return [load_mask for _, load_mask in sorted(found, reverse=True)]
+
+    stations = []
+
+    def search(mask, assigned_time):
+        nonlocal best_count, best
+        if mask == full:
+            if len(stations) < best_count:
+                best_count = len(stations)
+                best = np.empty(problem.n, dtype=np.int64)
+                for station, load_mask in enumerate(stations):
+                    for i in range(problem.n):
+                        if load_mask >> i & 1:
+                            best[i] = station
+            return True
+        budget[0] -= 1
+        if budget[0] < 0:
+            return False
+        if len(stations) + lower_bound(assigned_time) >= best_count or seen.get(mask, best_count + 1) <= len(stations):
+            return True
+        seen[mask] = len(stations)
+        next_loads = loads(mask)
+        if budget[0] < 0:
+            return False
+        for load_mask in next_loads:
+            stations.append(load_mask)
+            load_time = sum(times[i] for i in range(problem.n) if load_mask >> i & 1)
+            finished = search(mask | load_mask, assigned_time + load_time)
+            stations.pop()
+            if not finished:
+                return False
+        return True
+
+    proven = search(0, 0.0)
+    return best, proven
+
+
+def _assign(problem, cycle_time, budget=None):
+    # Fewest stations within a cycle time: (station of each operation, parallel copies, proven optimal)
+    effective, parallel = _effective_times(problem, cycle_time)
+    station_of = _heuristic(problem, effective, cycle_time)
+    # Filling stations in order is optimal for a chain, and so is reaching the time bound
+    proven = problem.is_chain or station_of.max() + 1 <= math.ceil(effective.sum() / cycle_time - EPSILON)
+    if budget is not None and budget[0] > 0 and not proven:
+        station_of, proven = _exact(problem, effective, cycle_time, station_of, budget)
+    return station_of, parallel, proven
+
+
+def balance_line(process_map, cycle_time=None, n_stations=None, keep_sheet_order=True, exact=False):
+    """Assign the operations of a process map to stations.
+
+    With ``cycle_time`` (e.g. the takt time) the fewest stations are used, an operation
+    longer than it getting parallel copies of its station; with ``n_stations`` the
+    highest station time of that many stations is made as low as possible. Stations are
+    filled by ranked positional weight; ``exact`` adds a branch-and-bound search, cut off
+    after NODE_LIMIT nodes.
+
+    Returns (assignment, station table, proven optimal).
+    """
+    ops, predecessors = operations(process_map, keep_sheet_order)
+    if ops.empty:
+        raise ValueError('the process mapping has no stages to balance')
+    problem = _Problem(ops['Process Cycle Time'], predecessors)
+    if not np.isfinite(problem.times).all() or (problem.times < 0).any():
+        raise ValueError('every stage needs a Process Cycle Time of zero or more to balance the line')
+    if problem.times.sum() <= 0:
+        raise ValueError('the stages have no Process Cycle Time to balance')
+    budget = [NODE_LIMIT] if exact else None
+
+    if n_stations is not None:
+        if n_stations < 1:
+            raise ValueError('the line needs at least one station')
+        # Lowest cycle time that still fits: bisection between the obvious bounds
+        low = max(problem.times.max(), problem.times.sum() / n_stations)
+        high = max(problem.times.sum(), low)
+        station_of, parallel, proven = _assign(problem, high, budget)
+        while high - low > CYCLE_TIME_TOLERANCE:
+            middle = (low + high) / 2
+            candidate = _assign(problem, middle, budget)
+            if candidate[0].max() + 1 <= n_stations and (candidate[1] == 1).all():
+                high, (station_of, parallel, proven) = middle, candidate
+            else:
+                low = middle
+    elif cycle_time is not None and cycle_time > 0:
+        station_of, parallel, proven = _assign(problem, cycle_time, budget)
+    else:
+        raise ValueError('give a positive cycle time or a number of stations')
+
+    return _tables(ops, station_of, parallel) + (proven,)
+
+
+def _tables(ops, station_of, parallel):
+    # Stations are opened in line order, so they number from 1 as assigned
+    order = station_of + 1
+    assignment = ops.assign(Station=order)[ASSIGNMENT_COLUMNS]
+    per_copy = ops['Process Cycle Time'].to_numpy() / parallel
+    stations = pd.DataFrame({
+        'Station': order,
+        'Stage': ops['Stage'].astype(str),
+        'Parallel': parallel,
+        'Station Time (s)': per_copy,
+    }).groupby('Station', sort=True).agg(**{
+        'Operations': ('Stage', ', '.join),
+        'Parallel': ('Parallel', 'max'),
+        'Station Time (s)': ('Station Time (s)', 'sum'),
+    }).reset_index()[STATION_COLUMNS]
+    return assignment, stations
+
+
+def side_stations(process_map):
+    # The line as laid out today: one station per side, its stages worked in turn
+    sides = line_simulation.line_stations(process_map)
+    return pd.DataFrame({
+        'Station': sides['Station'],
+        'Operations': sides['Station'],
+        'Parallel': 1,
+        'Station Time (s)': sides['Cycle Time'],
+    })[STATION_COLUMNS]
+
+
+def line_metrics(stations, labour_cost_hr, calendar, work_content=None):
+    """Max CT, balance loss and labour cost per board of a station table.
+
+    Every station copy is taken to be staffed for the whole max CT of each board, so
+    the time it waits on the slowest station is paid as idle labour.
+    """
+    station_times = stations['Station Time (s)'].to_numpy(dtype=np.float64)
+    copies = stations['Parallel'].to_numpy(dtype=np.float64)
+    if work_content is None:
+        work_content = float((station_times * copies).sum())
+    max_ct = float(station_times.max())
+    paid = max_ct * copies.sum()
+    labour_rate = labour_cost_hr / cost_engine.SECONDS_PER_HOUR * cost_engine.LABOUR_OVERHEAD
+    efficiency = calendar.efficiency if calendar.efficiency > 0 else 1.0
+    return {
+        'Stations': int(copies.sum()),
+        'Max CT (s)': max_ct,
+        'Work Content (s)': work_content,
+        'Balance Loss %': (1 - work_content / paid) * 100 if paid > 0 else 0.0,
+        'Labour ($/board)': paid * labour_rate,
+        'Idle Labour ($/board)': (paid - work_content) * labour_rate,
+        'Output at Max CT (boards/year)': (
+            calendar.hours_per_year() * cost_engine.SECONDS_PER_HOUR * efficiency / max_ct if max_ct > 0 else 0.0
+        ),
+    }
@@ -0,0 +1,217 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import cost_engine
+
+# Sides of Process_CT in the order a board goes through them
+LINE_SIDES = ['SMT-Top', 'SMT-Bottom', 'Manual/TH Line', 'Testing/Box Build']
+
+# Boards that fit between two stations unless told otherwise
+BUFFER_BOARDS = 10
+
+STATION_COLUMNS = ['Station', 'Cycle Time', 'Batch Set up Time']
+
+# Vectorized sweeps tried before the remaining boards are worked out one at a time
+MAX_SWEEPS = 25
+
+HOURS_PER_DAY = 24
+DAYS_PER_WEEK = 7
+
+
+@dataclass(frozen=True)
+class ShiftCalendar:
+    """Working calendar of the line, as in Process_CT (Shift Hr/day, Days/Week, Weeks/Year).
+
+    The simulation clock only runs in working time; ``efficiency`` (Overall Labor
+    Efficiency) stretches every cycle and set-up time by 1 / efficiency.
+    """
+    shift_hr_day: float
+    days_week: float
+    weeks_year: float
+    efficiency: float = 1.0
+
+    def hours_per_year(self):
+        # Hr/Year (1 Shift) of Process_CT
+        return self.shift_hr_day * self.days_week * self.weeks_year
+
+    def calendar_hours(self, working_seconds):
+        # Elapsed hours, nights and weekends included, after a number of working seconds from a shift start
+        working_days, within_day = np.divmod(np.asarray(working_seconds, dtype=np.float64), self.shift_hr_day * cost_engine.SECONDS_PER_HOUR)
+        weeks, day_of_week = np.divmod(working_days, self.days_week)
+        return (
+            (weeks * DAYS_PER_WEEK + day_of_week) * HOURS_PER_DAY + within_day / cost_engine.SECONDS_PER_HOUR
+        )
+
+
+def line_order(process_map):
+    """Stage rows of a process map in the order a board meets them, with the side of each.
+
+    Sides are ordered as LINE_SIDES, other sides after them in sheet order, and the
+    sheet order is kept within a side; stages without a Side are on a 'Line' side.
+    Returns (stage rows, sides) sharing one index.
+    """
+    cost_engine.check_columns(process_map, ['Stage', 'Process Cycle Time', 'Batch Set up Time'], 'process mapping')
+    stages = process_map[process_map['Stage'].notna()]
+    sides = pd.Series('Line', index=stages.index, dtype=object)
+    if 'Side' in stages.columns:
+        sides = sides.where(stages['Side'].isna(), stages['Side'].astype(str))
+    side_order = {side: position for position, side in enumerate(LINE_SIDES)}
+    known = sides.map(side_order)
+    # Unknown sides after the known ones, in order of first appearance
+    unknown_codes = pd.Series(pd.factorize(sides.where(known.isna()))[0], index=stages.index)
+    order = known.fillna(len(LINE_SIDES) + unknown_codes).to_numpy()
+    stages = stages.iloc[np.argsort(order, kind='stable')]
+    return stages, sides.loc[stages.index]
+
+
+def line_stations(process_map, by_stage=False):
+    """Stations of a process map: one per side (its stages worked in turn, so the cycle and
+    set-up times add up, like 'CT of each stage'), or one per stage row with ``by_stage``.
+
+    Stations follow line_order.
+    """
+    stages, sides = line_order(process_map)
+    times = pd.DataFrame({
+        'Station': (sides + ': ' + stages['Stage'].astype(str)) if by_stage else sides,
+        'Cycle Time': stages['Process Cycle Time'].to_numpy(dtype=np.float64),
+        'Batch Set up Time': stages['Batch Set up Time'].to_numpy(dtype=np.float64),
+    })
+    if by_stage:
+        return times.reset_index(drop=True)
+    return times.groupby('Station', sort=False, as_index=False).sum()[STATION_COLUMNS]
+
+
+def _departures(service, setup, arrivals, blocked_until):
+    # Departures of one station, vectorized with the max-plus form of
+    #   D[n] = max(D[n-1] + setup[n] + service[n], arrivals[n] + service[n], blocked_until[n])
+    # (a set-up starts as soon as the previous board has left, before the next one arrives):
+    # D[n] = P[n] + max(0, max over k <= n of (X[k] - P[k])), with P the running sum of
+    # setup + service and X[k] = max(arrivals[k] + service[k], blocked_until[k])
+    elapsed = np.cumsum(setup + service)
+    ready = np.maximum(arrivals + service, blocked_until)
+    return elapsed + np.maximum(np.maximum.accumulate(ready - elapsed), 0.0)
+
+
+def _line_departures(service, setup, lags):
+    """Departure time of every board from every station, as a (stations, boards) array.
+
+    Board n can leave station j once board n - lags[j] has left station j + 1 (no
+    blocking when lags[j] is None). Blocking only ever delays departures, so sweeping
+    the stations downstream and back up again settles on the exact times, usually
+    within a few sweeps. Lines with small buffers and variable cycle times settle
+    only a few boards per sweep; after MAX_SWEEPS the boards from the first one
+    still moving are worked out one at a time instead.
+    """
+    n_stations, boards = service.shape
+    released = np.zeros(boards)
+    departures = np.zeros((n_stations, boards))
+    blocked_until = np.zeros((n_stations, boards))
+    order = list(range(n_stations)) + list(range(n_stations - 2, -1, -1))
+    for _ in range(MAX_SWEEPS):
+        previous_sweep = departures.copy()
+        for j in order:
+            if lags[j] is not None:
+                blocked_until[j, lags[j]:] = departures[j + 1, :boards - lags[j]]
+            arrivals = departures[j - 1] if j > 0 else released
+            departures[j] = _departures(service[j], setup[j], arrivals, blocked_until[j])
+        moving = np.flatnonzero((departures != previous_sweep).any(axis=0))
+        if len(moving) == 0:
+            return departures
+
+    # Boards before the first one still moving are settled; the rest follow in board order
+    service_rows, setup_rows, departure_rows = service.tolist(), setup.tolist(), departures.tolist()
+    for n in range(moving[0], boards):
+        arrival = 0.0
+        for j in range(n_stations):
+            departure = (departure_rows[j][n - 1] if n else 0.0) + setup_rows[j][n]
+            if arrival > departure:
+                departure = arrival
+            departure += service_rows[j][n]
+            lag = lags[j]
+            if lag is not None and n >= lag and departure_rows[j + 1][n - lag] > departure:
+                departure = departure_rows[j + 1][n - lag]
+            departure_rows[j][n] = arrival = departure
+    return np.array(departure_rows)
+
+
+def simulate_line(stations, boards, batch_size, calendar, buffers=BUFFER_BOARDS, cv=0.0, seed=None):
+    """Simulate ``boards`` boards through a serial line of stations.
+
+    Every board is released at once and worked in the station order of ``stations``
+    (see line_stations); each station sets up at the first board of every batch of
+    ``batch_size``. ``buffers`` is the number of boards that fit between consecutive
+    stations (one value, or one per gap); a station holding a finished board with a
+    full buffer after it is blocked. With ``cv`` > 0 cycle times are gamma distributed
+    with that coefficient of variation.
+
+    The line is evaluated on arrays of all boards at once: each station's departures
+    follow from a cumulative maximum, and the stations are swept until the blocking
+    times settle (see _line_departures). Returns (summary dict, per-station table).
+    """
+    n_stations = len(stations)
+    boards = int(boards)
+    if n_stations == 0 or boards <= 0:
+        raise ValueError('the line needs at least one station and one board')
+    efficiency = calendar.efficiency if calendar.efficiency > 0 else 1.0
+    cycle_time = stations['Cycle Time'].to_numpy(dtype=np.float64) / efficiency
+    setup_time = stations['Batch Set up Time'].to_numpy(dtype=np.float64) / efficiency
+    buffers = np.broadcast_to(np.asarray(buffers, dtype=np.float64), (max(n_stations - 1, 0),))
+
+    rng = np.random.default_rng(seed)
+    batch_starts = (np.arange(boards) % max(int(batch_size), 1)) == 0
+    service = np.empty((n_stations, boards))
+    for j in range(n_stations):
+        if cv > 0 and cycle_time[j] > 0:
+            shape = 1 / cv**2
+            service[j] = rng.gamma(shape, cycle_time[j] / shape, boards)
+        else:
+            service[j] = cycle_time[j]
+    setup = np.where(batch_starts, setup_time[:, np.newaxis], 0.0)
+
+    lags = [int(buffers[j]) + 1 if np.isfinite(buffers[j]) else None for j in range(n_stations - 1)] + [None]
+    departures = _line_departures(service, setup, lags)
+
+    # Station time: working (set-up + service), blocked (done but not passed on), the rest idle
+    arrivals = np.vstack([np.zeros(boards), departures[:-1]])
+    previous_departures = np.hstack([np.zeros((n_stations, 1)), departures[:, :-1]])
+    starts = np.maximum(arrivals, previous_departures + setup)
+    busy = service.sum(axis=1) + setup.sum(axis=1)
+    blocked = np.maximum(departures - (starts + service), 0.0).sum(axis=1)
+
+    # Lead time from the first station starting on a board to the board leaving the line
+    entered = starts[0]
+    finished = departures[-1]
+    makespan = finished[-1]
+    lead_time = finished - entered
+
+    utilization = busy / makespan if makespan > 0 else np.zeros(n_stations)
+    bottleneck = int(np.argmax(utilization))
+    station_table = pd.DataFrame({
+        'Station': stations['Station'].to_numpy(),
+        'Cycle Time (s)': cycle_time,
+        'Set up per Batch (s)': setup_time,
+        'Utilization %': utilization * 100,
+        'Blocked %': blocked / makespan * 100 if makespan > 0 else 0.0,
+        'Idle %': np.maximum(100 - (utilization + blocked / makespan) * 100, 0) if makespan > 0 else 100.0,
+    })
+
+    seconds_per_year = calendar.hours_per_year() * cost_engine.SECONDS_PER_HOUR
+    throughput = boards / makespan if makespan > 0 else 0.0
+    summary = {
+        'Boards': boards,
+        'Makespan (working h)': makespan / cost_engine.SECONDS_PER_HOUR,
+        'Makespan (calendar days)': float(calendar.calendar_hours(makespan)) / HOURS_PER_DAY,
+        'Throughput (boards/h)': throughput * cost_engine.SECONDS_PER_HOUR,
+        'Annual Capacity (boards)': throughput * seconds_per_year,
+        # Little's law over the run: boards in the line on average
+        'Mean WIP (boards)': lead_time.sum() / makespan if makespan > 0 else 0.0,
+        'Mean Lead Time (working h)': lead_time.mean() / cost_engine.SECONDS_PER_HOUR,
+        'Max Lead Time (working h)': lead_time.max() / cost_engine.SECONDS_PER_HOUR,
+        'Mean Lead Time (calendar h)': float(np.mean(calendar.calendar_hours(finished) - calendar.calendar_hours(entered))),
+        'Bottleneck': station_table['Station'].iloc[bottleneck],
+        'Bottleneck Utilization %': utilization[bottleneck] * 100,
+    }
+    return summary, station_table
+
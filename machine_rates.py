@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import cost_engine
+import stage_matching
+
+# Columns of the 'Machine data' machine table the rates are worked out from
+MACHINE_COLUMNS = ['Process', 'Lifetime', 'Machine cost', 'AMC %', 'Aux %', 'Wattage', 'Floor Area (m^2)', 'Shift', 'OEE']
+
+# RateAssumptions field of each basic attribute of the 'Machine data' sheet
+ATTRIBUTE_FIELDS = {
+    'Power rate/KWh': 'power_rate',
+    'Floor rent/m^2': 'floor_rent',
+    'Shift Hr/day': 'shift_hr_day',
+    'Days/Week': 'days_week',
+    'Weeks/Year': 'weeks_year',
+}
+
+MMR_MATCH_COLUMNS = ['Process Name', 'Machine', 'MMR-EMS MMR', 'MMR']
+
+RATE_COLUMNS = [
+    'Process', 'Depreciation ($/yr)', 'AMC ($/yr)', 'Aux ($/yr)', 'Power ($/yr)', 'Floor ($/yr)', 'Shift', 'OEE',
+    'Productive Hours/yr', 'MMR', 'Sheet MMR',
+]
+
+MINUTES_PER_HOUR = 60
+
+
+@dataclass(frozen=True)
+class RateAssumptions:
+    """Basic attributes of the 'Machine data' sheet that every machine-minute rate depends on.
+
+    ``shifts`` and ``utilization`` replace each machine's own Shift and OEE when given.
+    """
+    power_rate: float
+    floor_rent: float
+    shift_hr_day: float
+    days_week: float
+    weeks_year: float
+    shifts: float = None
+    utilization: float = None
+
+    def hours_per_year(self):
+        # Hr/Year (1 Shift) of the sheet
+        return self.shift_hr_day * self.days_week * self.weeks_year
+
+
+def attribute_values(attributes):
+    # {RateAssumptions field: value} of the basic attributes the 'Machine data (attributes)' table has
+    values = dict(zip(attributes['Attribute'], attributes['Value']))
+    return {field: float(values[attribute]) for attribute, field in ATTRIBUTE_FIELDS.items() if attribute in values}
+
+
+def rate_assumptions(attributes, **overrides):
+    # RateAssumptions from the 'Machine data (attributes)' table, with any fields given replaced
+    fields = {**attribute_values(attributes), **overrides}
+    missing = [attribute for attribute, field in ATTRIBUTE_FIELDS.items() if field not in fields]
+    if missing:
+        raise KeyError(f"Machine data: {', '.join(missing)}")
+    return RateAssumptions(**fields)
+
+
+class MachineRates:
+    """Machine-minute rates of the 'Machine data' machines, built once per master-data revision.
+
+    Each machine's MMR ($/min) follows the sheet's formula
+
+        (Machine cost / Lifetime + (AMC + Aux + Power) x Shift + Floor cost) / (Hr/Year x Shift x OEE) / 60
+
+    with Power = Wattage (kW) x Power rate/KWh x Hr/Year and Floor cost = Floor Area x
+    Floor rent/m^2. The terms that do not depend on the RateAssumptions are kept as
+    arrays, so a new set of assumptions is a few vector operations over all machines.
+    The MMR-EMS rows are matched to their machines once, on the normalized process
+    name and then by close trigram similarity, like process-map stages.
+    """
+
+    def __init__(self, machines, mmr):
+        cost_engine.check_columns(machines, MACHINE_COLUMNS, 'Machine data')
+        cost_engine.check_columns(mmr, ['Process Name', 'MMR'], 'MMR-EMS')
+
+        def numbers(column):
+            return pd.to_numeric(machines[column], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+
+        self.processes = machines['Process'].to_numpy(dtype=object)
+        machine_cost, lifetime = numbers('Machine cost'), numbers('Lifetime')
+        self.depreciation = np.divide(machine_cost, lifetime, out=np.zeros_like(machine_cost), where=lifetime > 0)
+        self.amc = machine_cost * numbers('AMC %')
+        self.aux = machine_cost * numbers('Aux %')
+        self.kilowatts = numbers('Wattage')
+        self.floor_area = numbers('Floor Area (m^2)')
+        self.shifts = numbers('Shift')
+        self.oee = numbers('OEE')
+        self.sheet_mmr = (
+            pd.to_numeric(machines['MMR'], errors='coerce').to_numpy(dtype=np.float64)
+            if 'MMR' in machines.columns else np.full(len(machines), np.nan)
+        )
+
+        # A process listed more than once takes the rate of its first row
+        self.matcher = stage_matching.StageMatcher(self.processes)
+        first_rows = np.full(len(self.matcher), -1, dtype=np.intp)
+        for row in range(len(self.processes) - 1, -1, -1):
+            if self.matcher.codes[row] >= 0:
+                first_rows[self.matcher.codes[row]] = row
+
+        # Machine row of each MMR-EMS row, -1 for the rows that keep the sheet's MMR
+        codes = self.matcher.match(mmr['Process Name'])[0]
+        self.mmr_codes = np.where(codes >= 0, first_rows[codes], -1)
+        self.mmr_names = mmr['Process Name'].to_numpy(dtype=object)
+        self.mmr_values = pd.to_numeric(mmr['MMR'], errors='coerce').to_numpy(dtype=np.float64)
+
+    def __len__(self):
+        return len(self.processes)
+
+    def nbytes(self):
+        return (
+            9 * self.depreciation.nbytes + self.mmr_codes.nbytes + self.mmr_values.nbytes + 100 * len(self.mmr_names)
+            + self.matcher.nbytes()
+        )
+
+    def _terms(self, assumptions):
+        # Yearly power and floor cost, shifts and utilization of every machine
+        hours = assumptions.hours_per_year()
+        power = self.kilowatts * assumptions.power_rate * hours
+        floor = self.floor_area * assumptions.floor_rent
+        shifts = self.shifts if assumptions.shifts is None else np.full(len(self), float(assumptions.shifts))
+        oee = self.oee if assumptions.utilization is None else np.full(len(self), float(assumptions.utilization))
+        return power, floor, shifts, oee, hours * shifts * oee
+
+    def rates(self, assumptions):
+        # MMR ($/min) of every machine; NaN for a machine with no productive hours
+        power, floor, shifts, _, productive_hours = self._terms(assumptions)
+        yearly = self.depreciation + (self.amc + self.aux + power) * shifts + floor
+        return np.divide(
+            yearly, productive_hours * MINUTES_PER_HOUR,
+            out=np.full(len(self), np.nan), where=productive_hours > 0,
+        )
+
+    def breakdown(self, assumptions):
+        # Yearly cost terms and MMR of every machine next to the MMR the sheet holds
+        power, floor, shifts, oee, productive_hours = self._terms(assumptions)
+        return pd.DataFrame({
+            'Process': self.processes,
+            'Depreciation ($/yr)': self.depreciation,
+            'AMC ($/yr)': self.amc,
+            'Aux ($/yr)': self.aux,
+            'Power ($/yr)': power,
+            'Floor ($/yr)': floor,
+            'Shift': shifts,
+            'OEE': oee,
+            'Productive Hours/yr': productive_hours,
+            'MMR': self.rates(assumptions),
+            'Sheet MMR': self.sheet_mmr,
+        }, columns=RATE_COLUMNS)
+
+    def mmr_column(self, assumptions):
+        # MMR column of MMR-EMS with the rate of each row's machine; other rows keep their MMR
+        rates = self.rates(assumptions)
+        machine_rates = np.where(self.mmr_codes >= 0, rates[np.maximum(self.mmr_codes, 0)], np.nan)
+        return np.where(np.isnan(machine_rates), self.mmr_values, machine_rates)
+
+    def mmr_matches(self, assumptions):
+        # MMR-EMS rows that take a machine's rate, with the MMR they had
+        matched = np.flatnonzero(self.mmr_codes >= 0)
+        return pd.DataFrame({
+            'Process Name': self.mmr_names[matched],
+            'Machine': self.processes[self.mmr_codes[matched]],
+            'MMR-EMS MMR': self.mmr_values[matched],
+            'MMR': self.mmr_column(assumptions)[matched],
+        }, columns=MMR_MATCH_COLUMNS)
@@ -0,0 +1,357 @@
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import Future, wait as futures_wait
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import background
+import sheet_schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # Without pyarrow the workbook is always parsed with openpyxl
+    pa = None
+
+# Sheets of simulation_db.xlsx used by the costing pages
+MASTER_SHEETS = ['Process_CT', 'NRE', 'MMR-EMS', 'Assumptions']
+
+# Reference sheets that are cached with the master sheets when the workbook has them
+OPTIONAL_SHEETS = ['SMD_Package_Feeder_Master', 'Consumables Calculator', 'OHP % Model', 'MMR-EMS (original)', 'Stage Aliases']
+
+# 'Machine data' is a hand-laid-out sheet; it is stored as a machine table plus its basic attributes
+MACHINE_SHEET = 'Machine data'
+MACHINE_ATTRIBUTES_SHEET = 'Machine data (attributes)'
+
+# Directory of the columnar sidecar cache, shared by every server process on the host
+CACHE_DIR = os.environ.get(
+    'COSTING_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.costing_cache')
+)
+
+# MasterData field holding each sheet
+SHEET_FIELDS = {
+    'Process_CT': 'process_ct',
+    'NRE': 'nre',
+    'MMR-EMS': 'mmr',
+    'Assumptions': 'assumptions',
+    'SMD_Package_Feeder_Master': 'smd_packages',
+    'Consumables Calculator': 'consumables',
+    'OHP % Model': 'ohp_model',
+    'MMR-EMS (original)': 'mmr_original',
+    'Stage Aliases': 'stage_aliases',
+    MACHINE_SHEET: 'machine_data',
+    MACHINE_ATTRIBUTES_SHEET: 'machine_attributes',
+}
+
+# Sheet holding each MasterData field
+_FIELD_SHEETS = {field: sheet_name for sheet_name, field in SHEET_FIELDS.items()}
+
+MANIFEST_NAME = 'manifest.json'
+
+# Bumped whenever the parsed layout changes, so sidecars written by older code are ignored
+SIDECAR_VERSION = 4
+
+
+@dataclass(frozen=True)
+class MasterData:
+    """Parsed master sheets of one simulation_db.xlsx revision.
+
+    The frames are shared between reruns and sessions, so treat them as read-only.
+    """
+    digest: str
+    process_ct: pd.DataFrame
+    nre: pd.DataFrame
+    mmr: pd.DataFrame
+    assumptions: pd.DataFrame
+    smd_packages: pd.DataFrame = None
+    consumables: pd.DataFrame = None
+    ohp_model: pd.DataFrame = None
+    machine_data: pd.DataFrame = None
+    machine_attributes: pd.DataFrame = None
+    mmr_original: pd.DataFrame = None
+    # Alternative stage names (Alias -> Process Name) accepted when matching process maps
+    stage_aliases: pd.DataFrame = None
+    # Cells that did not match the declared sheet schemas, one row per problem
+    issues: pd.DataFrame = None
+
+    def nbytes(self):
+        # Memory held by the parsed sheets, for the shared cache budget
+        return sum(
+            int(frame.memory_usage(deep=True).sum())
+            for frame in vars(self).values()
+            if isinstance(frame, pd.DataFrame)
+        )
+
+
+def content_hash(data):
+    # SHA-256 of the uploaded bytes, used as the cache key of a workbook revision
+    return hashlib.sha256(data).hexdigest()
+
+
+def sheet_digest(frame):
+    # Content hash of one parsed sheet, None for a sheet the workbook does not have
+    if frame is None:
+        return None
+    digest = hashlib.sha256(json.dumps([str(column) for column in frame.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def from_sheets(digest, sheets):
+    # Build MasterData from a {sheet name: frame} mapping; absent optional sheets stay None.
+    # Sheets with a declared schema are coerced here, once per workbook revision.
+    sheets = dict(sheets)
+    issues = []
+    for sheet_name in sheets:
+        sheets[sheet_name], sheet_issues = coerce_sheet(sheet_name, sheets[sheet_name])
+        issues.extend(sheet_issues)
+    return MasterData(
+        digest=digest,
+        issues=sheet_schema.issue_frame(issues),
+        **{field: sheets.get(name) for name, field in SHEET_FIELDS.items()},
+    )
+
+
+def coerce_sheet(sheet_name, frame):
+    schema = sheet_schema.SCHEMAS.get(sheet_name)
+    if frame is None or schema is None:
+        return frame, []
+    return sheet_schema.coerce(frame, schema, sheet_name)
+
+
+def start_master_data(data, digest=None, cache_dir=None):
+    """Load the master sheets of simulation_db.xlsx.
+
+    The Arrow sidecar cache is tried first and gives MasterData; on a miss this
+    returns at once with a PendingMasterData whose sheets are parsed on the
+    background pool and become available one by one, the costing sheets first.
+    The sidecar is written once they are all parsed.
+    """
+    if digest is None:
+        digest = content_hash(data)
+
+    sheets = read_sidecar(digest, cache_dir)
+    if sheets is not None:
+        return from_sheets(digest, sheets)
+    return PendingMasterData(data, digest, cache_dir)
+
+
+class PendingMasterData:
+    """MasterData being parsed on the background pool.
+
+    Reading a sheet field waits for that sheet only, so callers can work with
+    Process_CT and NRE while the rest of the workbook is still being parsed.
+    """
+
+    def __init__(self, data, digest, cache_dir=None):
+        self.digest = digest
+        self._futures = {sheet_name: Future() for sheet_name in SHEET_FIELDS}
+        self._issues = []
+        background.POOL.submit(self._parse, data, cache_dir)
+
+    def __getattr__(self, name):
+        sheet_name = _FIELD_SHEETS.get(name)
+        if sheet_name is None:
+            raise AttributeError(name)
+        return self._futures[sheet_name].result()
+
+    @property
+    def issues(self):
+        futures_wait(self._futures.values())
+        return sheet_schema.issue_frame(self._issues)
+
+    def futures(self, sheet_names):
+        return [self._futures[sheet_name] for sheet_name in sheet_names]
+
+    def progress(self):
+        # Fraction of the sheets parsed so far
+        return sum(future.done() for future in self._futures.values()) / len(self._futures)
+
+    def nbytes(self):
+        return sum(
+            int(future.result().memory_usage(deep=True).sum())
+            for future in self._futures.values()
+            if future.done() and not future.exception() and future.result() is not None
+        )
+
+    def _parse(self, data, cache_dir):
+        sheets = {}
+        try:
+            for sheet_name, frame in iter_workbook(data):
+                sheets[sheet_name] = frame
+                frame, issues = coerce_sheet(sheet_name, frame)
+                self._issues.extend(issues)
+                self._futures[sheet_name].set_result(frame)
+        except Exception as e:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Sheets the workbook does not have
+        for future in self._futures.values():
+            if not future.done():
+                future.set_result(None)
+        write_sidecar(self.digest, sheets, cache_dir)
+
+
+def iter_workbook(data):
+    # Open the workbook once and parse the sheets from the same handle, the costing sheets first
+    with pd.ExcelFile(io.BytesIO(data), engine='openpyxl') as xls:
+        missing = [name for name in MASTER_SHEETS if name not in xls.sheet_names]
+        if missing:
+            raise ValueError(f"simulation_db.xlsx is missing the sheet(s): {', '.join(missing)}")
+
+        for name in MASTER_SHEETS:
+            yield name, xls.parse(name)
+
+        if MACHINE_SHEET in xls.sheet_names:
+            machines, attributes = parse_machine_data(xls.parse(MACHINE_SHEET, header=None))
+            yield MACHINE_SHEET, machines
+            yield MACHINE_ATTRIBUTES_SHEET, attributes
+
+        for name in OPTIONAL_SHEETS:
+            if name in xls.sheet_names:
+                yield name, xls.parse(name)
+
+
+def parse_machine_data(raw):
+    """Split the raw 'Machine data' sheet into a machine table and a table of basic attributes.
+
+    The machine table starts at the header row holding 'Lifetime'; the cells above it are
+    label/value pairs such as 'Power rate/KWh' or 'Shift Hr/day'.
+    """
+    header_rows = raw.index[(raw == 'Lifetime').any(axis=1)]
+    if len(header_rows) == 0:
+        raise ValueError("'Machine data' sheet has no header row with 'Lifetime'")
+    header_row = header_rows[0]
+
+    # Machine table: keep the headed columns, the first one holds the process name
+    header = raw.loc[header_row].tolist()
+    header[0] = 'Process'
+    keep = [i for i, name in enumerate(header) if isinstance(name, str)]
+    machines = raw.loc[header_row + 1:, keep]
+    machines.columns = [header[i].strip() for i in keep]
+    machines = machines[machines['Process'].notna()].reset_index(drop=True)
+    for column in machines.columns[1:]:
+        machines[column] = pd.to_numeric(machines[column], errors='coerce')
+
+    # Basic attributes: a text cell followed by a number on its right
+    attributes = []
+    top = raw.loc[:header_row - 1]
+    for _, row in top.iterrows():
+        values = row.tolist()
+        for label, value in zip(values, values[1:]):
+            if isinstance(label, str) and isinstance(value, (int, float, np.number)) and not pd.isna(value):
+                attributes.append((label.strip(), float(value)))
+    return machines, pd.DataFrame(attributes, columns=['Attribute', 'Value'])
+
+
+def _sidecar_dir(digest, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, f'{digest}.v{SIDECAR_VERSION}')
+
+
+def _sidecar_file(sheet_name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', sheet_name) + '.arrow'
+
+
+def write_sidecar(digest, sheets, cache_dir=None):
+    """Write each sheet as an Arrow IPC file; the manifest is written last and marks the entry complete."""
+    if pa is None:
+        return False
+
+    directory = _sidecar_dir(digest, cache_dir)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        manifest = {}
+        for sheet_name, frame in sheets.items():
+            file_name = _sidecar_file(sheet_name)
+            _write_atomic(os.path.join(directory, file_name), _to_arrow(frame))
+            manifest[sheet_name] = file_name
+
+        tmp_path = os.path.join(directory, f'{MANIFEST_NAME}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+    except OSError:
+        # The cache is best effort, e.g. on a read-only deployment
+        return False
+    return True
+
+
+def read_sidecar(digest, cache_dir=None):
+    """Memory-map the cached sheets of a workbook revision, or return None on a miss."""
+    if pa is None:
+        return None
+
+    directory = _sidecar_dir(digest, cache_dir)
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+        sheets = {}
+        for sheet_name, file_name in manifest.items():
+            with pa.memory_map(os.path.join(directory, file_name), 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+            sheets[sheet_name] = _from_arrow(table)
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+    return sheets
+
+
+def _write_atomic(path, table):
+    # Write to a private temp file and rename, so readers in other processes never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _to_arrow(frame):
+    # Label grids such as 'OHP % Model' mix text and numbers in one column; those columns are
+    # stored as strings and their names kept in the schema metadata to be restored on read
+    frame = frame.copy()
+    mixed_columns = []
+    for column in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            frame[column] = frame[column].map(lambda value: value if pd.isna(value) else str(value))
+            mixed_columns.append(column)
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'mixed_columns'] = json.dumps(mixed_columns).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def _from_arrow(table):
+    frame = table.to_pandas()
+    # Arrow hands back None for missing text; keep NaN like read_excel does
+    for column in frame.columns[frame.dtypes == object]:
+        frame[column] = frame[column].where(frame[column].notna(), np.nan)
+
+    metadata = table.schema.metadata or {}
+    for column in json.loads(metadata.get(b'mixed_columns', b'[]')):
+        frame[column] = frame[column].map(_restore_number)
+    return frame
+
+
+def _restore_number(value):
+    # Numbers of a mixed column come back as the int or float read_excel produced;
+    # text such as '0603' that only looks numeric stays text
+    if not isinstance(value, str):
+        return value
+    for number_type in (int, float):
+        try:
+            number = number_type(value)
+        except ValueError:
+            continue
+        if str(number) == value:
+            return number
+    return value
@@ -0,0 +1,283 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import master_data
+
+# Local SQLite store of the master data, so simulation_db.xlsx does not have to be uploaded every time
+DB_PATH = os.environ.get(
+    'COSTING_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'master_data.sqlite')
+)
+
+# Stored sheets: sheet name -> (table name, key columns). Key columns identify a row across
+# workbook revisions and are indexed; sheets without key columns are keyed by row position.
+STORE_TABLES = {
+    'Process_CT': ('process_ct', ['Side', 'Stage']),
+    'NRE': ('nre', ['Item']),
+    'MMR-EMS': ('mmr_ems', ['Machine/Line', 'Process Name']),
+    'MMR-EMS (original)': ('mmr_ems_original', ['Machine/Line', 'Process Name']),
+    'Assumptions': ('assumptions', []),
+    'SMD_Package_Feeder_Master': ('smd_package_feeder_master', ['Package_Master']),
+    'Stage Aliases': ('stage_aliases', ['Alias']),
+    master_data.MACHINE_SHEET: ('machine_data', ['Process']),
+    master_data.MACHINE_ATTRIBUTES_SHEET: ('machine_attributes', ['Attribute']),
+}
+
+# Bookkeeping columns kept next to the sheet columns of every stored row
+KEY_COLUMN = '_key'
+HASH_COLUMN = '_row_hash'
+POSITION_COLUMN = '_position'
+INTERNAL_COLUMNS = [KEY_COLUMN, HASH_COLUMN, POSITION_COLUMN]
+
+
+def connect(db_path=None):
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=30)
+    # WAL lets every session read while an import is being written
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _column_type(series):
+    if pd.api.types.is_integer_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return 'INTEGER'
+    if pd.api.types.is_numeric_dtype(series):
+        return 'REAL'
+    if series.dropna().map(type).eq(str).all():
+        return 'TEXT'
+    # Mixed text/number columns such as Package_Master keep each value's own type
+    return ''
+
+
+def _row_keys(frame, keys):
+    # Key values joined into one string; repeated keys (e.g. several 'Link Conveyor' rows)
+    # are told apart by their occurrence number
+    if keys:
+        base = frame[keys].astype(object).where(frame[keys].notna(), '').astype(str).agg(' / '.join, axis=1)
+    else:
+        base = pd.Series('row', index=frame.index)
+    occurrence = base.groupby(base).cumcount()
+    return base.where(occurrence == 0, base + ' #' + (occurrence + 1).astype(str))
+
+
+def _row_hashes(frame):
+    return pd.util.hash_pandas_object(frame, index=False).map('{:016x}'.format)
+
+
+def _rows(frame, row_keys, row_hashes):
+    # Python scalars with None for missing values, as sqlite3 expects; the frame index is the row position
+    values = frame.astype(object).where(frame.notna(), None)
+    values[KEY_COLUMN] = row_keys.values
+    values[HASH_COLUMN] = row_hashes.values
+    values[POSITION_COLUMN] = frame.index
+    return values.itertuples(index=False, name=None)
+
+
+def _stored_columns(conn, table):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+    return columns or None
+
+
+def _create_table(conn, table, frame):
+    columns = [f'{_quote(column)} {_column_type(frame[column])}' for column in frame.columns]
+    columns += [f'{_quote(KEY_COLUMN)} TEXT PRIMARY KEY', f'{_quote(HASH_COLUMN)} TEXT', f'{_quote(POSITION_COLUMN)} INTEGER']
+    conn.execute(f'CREATE TABLE {_quote(table)} ({", ".join(columns)})')
+
+
+def _create_indexes(conn, table, keys):
+    # One index per key column for the point lookups below; stores imported without them get them on the next import
+    for column in keys:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"idx_{table}_{column}")} ON {_quote(table)} ({_quote(column)})')
+
+
+def _sync_table(conn, table, keys, frame):
+    """Bring one stored table in line with a sheet, touching only the rows that changed."""
+    stored_columns = _stored_columns(conn, table)
+    stored = {}
+    if stored_columns and KEY_COLUMN in stored_columns:
+        stored = {
+            key: (row_hash, position)
+            for key, row_hash, position in conn.execute(
+                f'SELECT {_quote(KEY_COLUMN)}, {_quote(HASH_COLUMN)}, {_quote(POSITION_COLUMN)} FROM {_quote(table)}'
+            )
+        }
+
+    if frame is None:
+        if stored_columns:
+            conn.execute(f'DROP TABLE {_quote(table)}')
+        return {'inserted': [], 'updated': [], 'deleted': sorted(stored), 'schema_changed': False}
+
+    frame = frame.reset_index(drop=True)
+    row_keys = _row_keys(frame, keys)
+    row_hashes = _row_hashes(frame)
+
+    # A new column layout cannot be patched row by row; rebuild the table and report every kept row as updated
+    # SQLite column names are text, so headers such as 2023 are compared as written
+    schema_changed = stored_columns is not None and stored_columns[:-len(INTERNAL_COLUMNS)] != list(map(str, frame.columns))
+    if stored_columns is None or schema_changed:
+        if stored_columns is not None:
+            conn.execute(f'DROP TABLE {_quote(table)}')
+        _create_table(conn, table, frame)
+        _create_indexes(conn, table, keys)
+        conn.executemany(
+            f'INSERT INTO {_quote(table)} VALUES ({", ".join("?" * (len(frame.columns) + 3))})',
+            _rows(frame, row_keys, row_hashes),
+        )
+        new_keys = set(row_keys)
+        return {
+            'inserted': sorted(new_keys - set(stored)),
+            'updated': sorted(new_keys & set(stored)),
+            'deleted': sorted(set(stored) - new_keys),
+            'schema_changed': schema_changed,
+        }
+
+    _create_indexes(conn, table, keys)
+
+    # Row-level diff on the key and the hash of the row values
+    inserted, updated, moved = [], [], []
+    for position, (key, row_hash) in enumerate(zip(row_keys, row_hashes)):
+        if key not in stored:
+            inserted.append(position)
+        elif stored[key][0] != row_hash:
+            updated.append(position)
+        elif stored[key][1] != position:
+            moved.append((position, key))
+    deleted = sorted(set(stored) - set(row_keys))
+
+    conn.executemany(f'DELETE FROM {_quote(table)} WHERE {_quote(KEY_COLUMN)} = ?', [(key,) for key in deleted])
+    changed = sorted(inserted + updated)
+    if changed:
+        conn.executemany(
+            f'INSERT OR REPLACE INTO {_quote(table)} VALUES ({", ".join("?" * (len(frame.columns) + 3))})',
+            _rows(frame.iloc[changed], row_keys.iloc[changed], row_hashes.iloc[changed]),
+        )
+    # Unchanged rows only need their position updated when rows were added or removed above them
+    conn.executemany(
+        f'UPDATE {_quote(table)} SET {_quote(POSITION_COLUMN)} = ? WHERE {_quote(KEY_COLUMN)} = ?', moved
+    )
+
+    return {
+        'inserted': [row_keys[position] for position in inserted],
+        'updated': [row_keys[position] for position in updated],
+        'deleted': deleted,
+        'schema_changed': False,
+    }
+
+
+def import_master_data(master, db_path=None, incremental=True):
+    """Store the sheets of a parsed simulation_db.xlsx and report what changed.
+
+    With ``incremental`` (the default) each sheet is diffed row by row against the
+    stored revision and only inserts, updates and deletes are applied; otherwise the
+    tables are rebuilt. Returns {sheet name: {'inserted', 'updated', 'deleted',
+    'schema_changed'}} listing row keys.
+    """
+    report = {}
+    with closing(connect(db_path)) as conn, conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        for sheet_name, (table, keys) in STORE_TABLES.items():
+            if not incremental:
+                conn.execute(f'DROP TABLE IF EXISTS {_quote(table)}')
+            changes = _sync_table(conn, table, keys, getattr(master, master_data.SHEET_FIELDS[sheet_name]))
+            if changes['inserted'] or changes['updated'] or changes['deleted'] or changes['schema_changed']:
+                report[sheet_name] = changes
+
+        conn.executemany(
+            'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+            [('digest', master.digest), ('imported_at', datetime.now().isoformat(timespec='seconds'))],
+        )
+    return report
+
+
+def report_frame(report):
+    # One line per changed sheet, for display next to the import button
+    return pd.DataFrame(
+        [
+            {
+                'Sheet': sheet_name,
+                'Inserted': len(changes['inserted']),
+                'Updated': len(changes['updated']),
+                'Deleted': len(changes['deleted']),
+                'Columns Changed': changes['schema_changed'],
+            }
+            for sheet_name, changes in report.items()
+        ],
+        columns=['Sheet', 'Inserted', 'Updated', 'Deleted', 'Columns Changed'],
+    )
+
+
+def stored_digest(db_path=None):
+    """Content hash of the stored workbook revision, or None when nothing has been imported."""
+    if not os.path.exists(db_path or DB_PATH):
+        return None
+    with closing(connect(db_path)) as conn:
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'digest'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+    return row[0] if row else None
+
+
+def load_master_data(db_path=None):
+    """Read the stored sheets back as MasterData, or None when the store is empty."""
+    digest = stored_digest(db_path)
+    if digest is None:
+        return None
+
+    with closing(connect(db_path)) as conn:
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        sheets = {
+            sheet_name: _read_table(conn, table)
+            for sheet_name, (table, _) in STORE_TABLES.items()
+            if table in existing
+        }
+    return master_data.from_sheets(digest, sheets)
+
+
+def _read_table(conn, table):
+    frame = pd.read_sql_query(f'SELECT * FROM {_quote(table)} ORDER BY {_quote(POSITION_COLUMN)}', conn)
+    frame = frame.drop(columns=INTERNAL_COLUMNS)
+    declared = {row[1]: row[2] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')}
+    # SQLite hands back None for missing values; keep NaN like read_excel does, and float64 for
+    # numeric columns that hold no value at all
+    for column in frame.columns[frame.dtypes == object]:
+        if declared.get(column) in ('REAL', 'INTEGER'):
+            frame[column] = frame[column].astype(np.float64)
+        else:
+            frame[column] = frame[column].where(frame[column].notna(), np.nan)
+    return frame
+
+
+def _lookup(table, column, value, db_path=None):
+    # Indexed point query returning the matching rows as dicts
+    with closing(connect(db_path)) as conn:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            f'SELECT * FROM {_quote(table)} WHERE {_quote(column)} = ? ORDER BY {_quote(POSITION_COLUMN)}', (value,)
+        ).fetchall()
+    return [{key: row[key] for key in row.keys() if key not in INTERNAL_COLUMNS} for row in rows]
+
+
+def nre_item(item, db_path=None):
+    rows = _lookup('nre', 'Item', item, db_path)
+    return rows[0] if rows else None
+
+
+def mmr_for_process(process_name, db_path=None):
+    return _lookup('mmr_ems', 'Process Name', process_name, db_path)
+
+
+def package(package_name, db_path=None):
+    rows = _lookup('smd_package_feeder_master', 'Package_Master', package_name, db_path)
+    # Chip sizes such as 0402 are stored as the numbers Excel read them as
+    if not rows and isinstance(package_name, str) and package_name.strip().isdigit():
+        rows = _lookup('smd_package_feeder_master', 'Package_Master', int(package_name), db_path)
+    return rows[0] if rows else None
+
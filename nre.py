@@ -0,0 +1,312 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Columns of an NRE mapping table
+NRE_COLUMNS = ['Item', 'Unit Price (₹)', 'Life Cycle (Boards)', 'Qty for LCV', 'Extended Price (₹)']
+
+
+class NreCatalog:
+    """Hash-indexed view of the NRE sheet.
+
+    Built once per master-data revision: item lookups are dict hits instead of
+    boolean masks over the sheet, the selectbox options are prepared once, and the
+    Qty for LCV / Extended Price of every item are worked out together for the
+    current Product Volume.
+    """
+
+    def __init__(self, nre):
+        # Like the mask lookups it replaces, the first row of a repeated item wins
+        items = nre['Item']
+        keep = (items.notna() & ~items.duplicated()).to_numpy()
+        self.items = items[keep].tolist()
+        self.options = [''] + self.items
+        self.unit_price = nre['Unit Price (₹)'].to_numpy(dtype=np.float64)[keep]
+        self.life_cycle_boards = nre['Life Cycle (Boards)'].to_numpy(dtype=np.float64)[keep]
+        self._index = {item: position for position, item in enumerate(self.items)}
+        # (product volume, qty, extended price) of the last volume asked for; shared by sessions,
+        # so it is replaced as one tuple
+        self._priced = (None, None, None)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def position(self, item):
+        return self._index[item]
+
+    def lcv_prices(self, product_volume):
+        """Qty for LCV and Extended Price of every item, as arrays in catalog order.
+
+        Qty for LCV is max(Product Volume, Life Cycle) / Life Cycle; items without a
+        life cycle get NaN.
+        """
+        priced = self._priced
+        if priced[0] != product_volume:
+            life = np.where(self.life_cycle_boards > 0, self.life_cycle_boards, np.nan)
+            qty_for_lcv = np.maximum(product_volume, life) / life
+            priced = (product_volume, qty_for_lcv, self.unit_price * qty_for_lcv)
+            self._priced = priced
+        return priced[1], priced[2]
+
+    def record(self, item, product_volume):
+        """Unit Price, Life Cycle, Qty for LCV and Extended Price of one item."""
+        position = self._index[item]
+        qty_for_lcv, ext_price = self.lcv_prices(product_volume)
+        return {
+            'Item': item,
+            'Unit Price (₹)': self.unit_price[position],
+            'Life Cycle (Boards)': self.life_cycle_boards[position],
+            'Qty for LCV': qty_for_lcv[position],
+            'Extended Price (₹)': ext_price[position],
+        }
+
+    def price_items(self, items, product_volume):
+        """NRE mapping rows of many items, priced in one pass into a preallocated table.
+
+        Unknown items are skipped; use unknown_items to report them.
+        """
+        positions = np.fromiter(
+            (self._index[item] for item in items if item in self._index), dtype=np.intp
+        )
+        qty_for_lcv, ext_price = self.lcv_prices(product_volume)
+        table = pd.DataFrame(index=pd.RangeIndex(len(positions)), columns=NRE_COLUMNS)
+        table['Item'] = [self.items[position] for position in positions]
+        table['Unit Price (₹)'] = self.unit_price[positions]
+        table['Life Cycle (Boards)'] = self.life_cycle_boards[positions]
+        table['Qty for LCV'] = qty_for_lcv[positions]
+        table['Extended Price (₹)'] = ext_price[positions]
+        return table
+
+    def unknown_items(self, items):
+        return [item for item in items if item not in self._index]
+
+    def nbytes(self):
+        return self.unit_price.nbytes + self.life_cycle_boards.nbytes + sum(len(item) for item in self.items)
+
+
+
+class NreBuffer:
+    """Append-only, columnar NRE mapping kept in session state.
+
+    Rows are appended to per-column lists and deleted by tombstone, so adding or
+    deleting a line never copies the table. Every action (one line, a bulk add or a
+    delete) is one undo step. The DataFrame view is only built when it is asked for
+    and then reused until the next change.
+    """
+
+    def __init__(self, columns=NRE_COLUMNS):
+        self.columns = list(columns)
+        self._values = {column: [] for column in self.columns}
+        self._alive = []
+        self._live_rows = {}  # item -> row of its live line
+        self._undo = []
+        self._redo = []
+        self._frame = None
+
+    def __len__(self):
+        return len(self._live_rows)
+
+    def __contains__(self, item):
+        return item in self._live_rows
+
+    def items(self):
+        return list(self._live_rows)
+
+    def add(self, rows):
+        """Append line dicts (or a DataFrame); items already in the mapping are skipped.
+
+        Returns the number of lines added.
+        """
+        if isinstance(rows, pd.DataFrame):
+            rows = rows.to_dict('records')
+        added = []
+        for row in rows:
+            if row['Item'] in self._live_rows:
+                continue
+            for column in self.columns:
+                self._values[column].append(row.get(column))
+            self._alive.append(True)
+            self._live_rows[row['Item']] = len(self._alive) - 1
+            added.append(len(self._alive) - 1)
+        if added:
+            self._record(('add', added))
+            self._frame = None
+        return len(added)
+
+    def delete(self, items):
+        deleted = [self._live_rows[item] for item in items if item in self._live_rows]
+        if deleted:
+            self._set_alive(deleted, False)
+            self._record(('delete', deleted))
+        return len(deleted)
+
+    def undo(self):
+        if not self._undo:
+            return False
+        action, rows = self._undo.pop()
+        self._set_alive(rows, action == 'delete')
+        self._redo.append((action, rows))
+        return True
+
+    def redo(self):
+        if not self._redo:
+            return False
+        action, rows = self._redo.pop()
+        self._set_alive(rows, action == 'add')
+        self._undo.append((action, rows))
+        return True
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def frame(self):
+        # Live lines in the order they were added
+        if self._frame is None:
+            live = [row for row, alive in enumerate(self._alive) if alive]
+            self._frame = pd.DataFrame(
+                {column: [self._values[column][row] for row in live] for column in self.columns},
+                columns=self.columns,
+            )
+        return self._frame
+
+    def _record(self, action):
+        self._undo.append(action)
+        self._redo.clear()
+
+    def _set_alive(self, rows, alive):
+        for row in rows:
+            self._alive[row] = alive
+            item = self._values['Item'][row]
+            if alive:
+                self._live_rows[item] = row
+            elif self._live_rows.get(item) == row:
+                del self._live_rows[item]
+        self._frame = None
+
+
+def parse_item_list(text):
+    # Pasted item lists: one item per line (or tab-separated cells copied from Excel), blanks ignored
+    return [item.strip() for item in re.split(r'[\r\n\t]+', text) if item.strip()]
+
+
+def summarize(extended_prices, product_volume, tool_maintenance_rate):
+    """Total Cost, tool maintenance, total Extended Price and NRE per Unit of an NRE mapping.
+
+    ``tool_maintenance_rate`` is a fraction, e.g. 0.1 for 10%.
+    """
+    total_cost = float(np.nansum(np.asarray(extended_prices, dtype=np.float64)))
+    tool_maintenance_cost = total_cost * tool_maintenance_rate
+    total_extended_price = total_cost + tool_maintenance_cost
+    nre_per_unit = total_extended_price / product_volume if product_volume else 0
+    return {
+        'Total Cost (₹)': total_cost,
+        'Tool Maintenance (₹)': tool_maintenance_cost,
+        'Extended Price (₹)': total_extended_price,
+        'NRE per Unit (₹)': nre_per_unit,
+    }
+
+
+def parse_number_list(text):
+    # '5000, 10000; 20k' style lists typed into a text box; raises ValueError on anything else
+    numbers = []
+    for part in re.split(r'[,;\s]+', text.strip()):
+        if part:
+            multiplier = 1000 if part[-1] in 'kK' else 1
+            numbers.append(float(part.rstrip('kK')) * multiplier)
+    return numbers
+
+
+def nre_surface(unit_price, life_cycle_boards, annual_volumes, product_lives, tool_maintenance_rate=0.0):
+    """NRE per Unit over a grid of Annual Volume x Product Life, in one broadcast computation.
+
+    ``unit_price`` and ``life_cycle_boards`` describe the NRE items (one entry each);
+    the result has one row per annual volume and one column per product life. Each item's
+    Qty for LCV is max(Product Volume, Life Cycle) / Life Cycle, so it starts to climb
+    where the product volume crosses that tool's life cycle.
+    """
+    unit_price = np.nan_to_num(np.asarray(unit_price, dtype=np.float64))
+    life = np.asarray(life_cycle_boards, dtype=np.float64)
+    life = np.where(life > 0, life, np.nan)
+    product_volume = np.multiply.outer(
+        np.asarray(annual_volumes, dtype=np.float64), np.asarray(product_lives, dtype=np.float64)
+    )
+
+    # (volumes, lives, items) quantities, reduced over the items with the unit prices
+    qty_for_lcv = np.maximum(product_volume[..., np.newaxis], life) / life
+    total_cost = np.nan_to_num(qty_for_lcv) @ unit_price
+    total_extended_price = total_cost * (1 + tool_maintenance_rate)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(product_volume > 0, total_extended_price / product_volume, 0.0)
+
+
+def allocate_portfolio(usage, catalog, tool_maintenance_rate=0.0):
+    """Pool NRE items shared across a product portfolio and split their cost back per unit.
+
+    ``usage`` has one row per product and NRE item it uses, with the columns Product,
+    Item, Annual Volume and Product Life (the volume and life of a product are taken
+    from its first row). Each item is sized once against the combined product volume of
+    the products sharing it, and its cost is split in proportion to their volumes.
+    Products x items are handled as a sparse incidence list (coordinate arrays), so
+    portfolios of hundreds of products and thousands of tools stay cheap.
+
+    Returns (products, items, unknown items): per-product and per-item tables, and the
+    item names not found in the catalog.
+    """
+    unknown = sorted(set(catalog.unknown_items(usage['Item'].dropna().unique())))
+    usage = usage[usage['Item'].isin(catalog.items) & usage['Product'].notna()]
+
+    product_codes, products = pd.factorize(usage['Product'])
+    first_rows = usage.groupby(product_codes, sort=True).head(1)
+    product_volume = (
+        pd.to_numeric(first_rows['Annual Volume'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        * pd.to_numeric(first_rows['Product Life'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    )
+
+    # Incidence in coordinate form, one entry per distinct (product, item)
+    item_positions = usage['Item'].map(catalog.position).to_numpy(dtype=np.intp)
+    pairs = np.unique(np.stack([product_codes, item_positions], axis=1), axis=0)
+    rows, cols = pairs[:, 0], pairs[:, 1]
+    n_products, n_items = len(products), len(catalog.items)
+
+    unit_price = catalog.unit_price
+    life = np.where(catalog.life_cycle_boards > 0, catalog.life_cycle_boards, np.nan)
+    uplift = 1 + tool_maintenance_rate
+
+    # Each item sized once against the pooled volume of its products
+    pooled_volume = np.bincount(cols, weights=product_volume[rows], minlength=n_items)
+    item_cost = np.nan_to_num(unit_price * np.maximum(pooled_volume, life) / life) * uplift
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(pooled_volume[cols] > 0, product_volume[rows] / pooled_volume[cols], 0.0)
+    allocated = np.bincount(rows, weights=item_cost[cols] * share, minlength=n_products)
+
+    # The same products costed in isolation, for comparison
+    standalone = np.bincount(
+        rows,
+        weights=np.nan_to_num(unit_price[cols] * np.maximum(product_volume[rows], life[cols]) / life[cols]) * uplift,
+        minlength=n_products,
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        product_table = pd.DataFrame({
+            'Product': products,
+            'Product Volume': product_volume,
+            'NRE Items': np.bincount(rows, minlength=n_products),
+            'Shared NRE (₹)': allocated,
+            'NRE per Unit (₹)': np.where(product_volume > 0, allocated / product_volume, 0.0),
+            'Standalone NRE (₹)': standalone,
+            'Standalone NRE per Unit (₹)': np.where(product_volume > 0, standalone / product_volume, 0.0),
+        })
+
+    used = np.flatnonzero(np.bincount(cols, minlength=n_items))
+    item_table = pd.DataFrame({
+        'Item': [catalog.items[position] for position in used],
+        'Products': np.bincount(cols, minlength=n_items)[used],
+        'Pooled Volume': pooled_volume[used],
+        'Qty for LCV': (np.maximum(pooled_volume, life) / life)[used],
+        'Extended Price (₹)': item_cost[used],
+    })
+    return product_table, item_table, unknown
@@ -0,0 +1,165 @@
+import contextlib
+import io
+import os
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+
+import openpyxl
+import pandas as pd
+
+import background
+import sheet_schema
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Columns of a CSV process map that split it into virtual sheets, in order of preference
+GROUP_COLUMNS = ['Sheet', 'Product', 'Product Name', 'Part Number', 'Build Stage']
+
+# Rows read per chunk when streaming a CSV process map
+CHUNK_ROWS = 50_000
+
+
+def list_sheet_names(data):
+    """Return the sheet names of an .xlsx/.xlsm workbook without parsing any cells."""
+    try:
+        # The sheet list lives in the workbook manifest, xl/workbook.xml
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            root = ET.fromstring(archive.read('xl/workbook.xml'))
+        return [sheet.get('name') for sheet in root.iter(f'{_MAIN_NS}sheet')]
+    except (KeyError, ET.ParseError):
+        # Non-standard package layout, let openpyxl resolve the manifest
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+        try:
+            return workbook.sheetnames
+        finally:
+            workbook.close()
+
+
+class LazyWorkbook:
+    """Process-mapping workbook whose sheets are parsed on first access.
+
+    Only the manifest is read when the handle is created; each sheet is parsed
+    the first time it is requested and kept for later reruns. Sheets requested
+    with a schema are coerced once as well and their problems kept in ``issues``.
+    Each sheet has its own lock, so different sheets are parsed side by side while
+    sessions asking for the same sheet wait for one parse.
+    """
+
+    def __init__(self, data, name, sheet_names=None):
+        self.name = name
+        self._data = data
+        self.sheet_names = list_sheet_names(data) if sheet_names is None else sheet_names
+        self._sheets = {}
+        self._coerced = {}
+        self.issues = {}
+        self._loaded_bytes = 0
+        self._lock = threading.Lock()
+        self._sheet_locks = {}
+        self._positions = {sheet_name: position for position, sheet_name in enumerate(self.sheet_names)}
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.sheet_names
+
+    def sheet(self, sheet_name, schema=None):
+        return self.sheets([sheet_name], schema)[sheet_name]
+
+    def sheets(self, sheet_names, schema=None):
+        """{sheet name: frame} of several sheets; the ones not parsed yet are parsed together."""
+        unknown = [sheet_name for sheet_name in sheet_names if sheet_name not in self._positions]
+        if unknown:
+            raise KeyError(unknown[0])
+
+        self._load(sheet_names)
+        if schema is None:
+            return {sheet_name: self._sheets[sheet_name] for sheet_name in sheet_names}
+        return {sheet_name: self._coerce(sheet_name, schema) for sheet_name in sheet_names}
+
+    def prefetch(self, sheet_names):
+        # Start parsing sheets on the background pool; sheet() then waits for the running parse
+        return background.POOL.submit(self._load, list(sheet_names))
+
+    def nbytes(self):
+        # Uploaded bytes plus every sheet parsed so far
+        return len(self._data) + self._loaded_bytes
+
+    def _locks(self, sheet_names):
+        # Locks of the sheets, always taken in workbook order so two loads cannot wait on each other
+        with self._lock:
+            ordered = sorted(set(sheet_names), key=self._positions.get)
+            return ordered, [self._sheet_locks.setdefault(sheet_name, threading.Lock()) for sheet_name in ordered]
+
+    def _load(self, sheet_names):
+        if all(sheet_name in self._sheets for sheet_name in sheet_names):
+            return
+        ordered, locks = self._locks(sheet_names)
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            missing = [sheet_name for sheet_name in ordered if sheet_name not in self._sheets]
+            if not missing:
+                return
+            parsed = self._parse(missing)
+            with self._lock:
+                for sheet_name in missing:
+                    self._sheets[sheet_name] = parsed[sheet_name]
+                    self._loaded_bytes += _frame_bytes(parsed[sheet_name])
+
+    def _coerce(self, sheet_name, schema):
+        if sheet_name not in self._coerced:
+            _, (lock,) = self._locks([sheet_name])
+            with lock:
+                if sheet_name not in self._coerced:
+                    frame, issues = sheet_schema.coerce(self._sheets[sheet_name], schema, sheet_name)
+                    with self._lock:
+                        self._coerced[sheet_name] = frame
+                        self._loaded_bytes += _frame_bytes(frame)
+                        self.issues[sheet_name] = sheet_schema.issue_frame(issues)
+        return self._coerced[sheet_name]
+
+    def _parse(self, sheet_names):
+        # {sheet name: frame}, the workbook read once for all of them
+        return pd.read_excel(io.BytesIO(self._data), sheet_name=sheet_names)
+
+
+class CsvWorkbook(LazyWorkbook):
+    """Process-mapping CSV split into virtual sheets, one per product or build stage.
+
+    MES exports put several products in one file; the first column found in
+    GROUP_COLUMNS names the virtual sheets. The file is only ever read in chunks of
+    CHUNK_ROWS rows: once for the group column alone, then once per load, splitting
+    out the rows of every sheet requested together.
+    """
+
+    def __init__(self, data, name):
+        columns = pd.read_csv(io.BytesIO(data), nrows=0).columns
+        self.group_column = next((column for column in GROUP_COLUMNS if column in columns), None)
+        if self.group_column is None:
+            # A plain single-product export is one sheet named after the file
+            super().__init__(data, name, [os.path.splitext(name)[0]])
+            return
+
+        groups = {}
+        for chunk in pd.read_csv(io.BytesIO(data), usecols=[self.group_column], dtype={self.group_column: str}, chunksize=CHUNK_ROWS):
+            groups.update(dict.fromkeys(_group_labels(chunk[self.group_column])))
+        super().__init__(data, name, list(groups))
+
+    def _parse(self, sheet_names):
+        if self.group_column is None:
+            return {sheet_names[0]: pd.read_csv(io.BytesIO(self._data))}
+
+        parts = {sheet_name: [] for sheet_name in sheet_names}
+        for chunk in pd.read_csv(io.BytesIO(self._data), dtype={self.group_column: str}, chunksize=CHUNK_ROWS):
+            for label, rows in chunk.groupby(_group_labels(chunk[self.group_column]), sort=False):
+                if label in parts:
+                    parts[label].append(rows)
+        return {sheet_name: pd.concat(frames, ignore_index=True) for sheet_name, frames in parts.items()}
+
+
+def _group_labels(values):
+    # Group values are read as text, so '0603' and 1001 name sheets as written; rows without one form their own sheet
+    return values.fillna('(no value)')
+
+
+def _frame_bytes(frame):
+    return int(frame.memory_usage(deep=True).sum())
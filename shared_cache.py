@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Memory budget of the shared cache in MB, for all sessions of the server process together
+CACHE_MB = float(os.environ.get('COSTING_CACHE_MB', '512'))
+
+
+def size_of(value):
+    # Objects that know their footprint report it; frames and raw bytes are measured directly
+    if hasattr(value, 'nbytes') and callable(value.nbytes):
+        return value.nbytes()
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return 0
+
+
+class SharedCache:
+    """Process-wide LRU cache of parsed workbooks, keyed by content hash.
+
+    Every Streamlit session of the server reads the same parsed objects, so they must
+    be treated as read-only. When the entries outgrow ``max_bytes`` the least recently
+    used ones are dropped; the entry just loaded is always kept.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Sessions asking for the same key wait for one load instead of parsing it again
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+                self.misses += 1
+
+            value = loader()
+            with self._lock:
+                self._entries[key] = value
+                self._sizes[key] = size_of(value)
+                self._evict(keep=key)
+                self._key_locks.pop(key, None)
+            return value
+
+    def resize(self, key):
+        # Lazily parsed entries grow as sheets are read; re-measure and evict if needed
+        with self._lock:
+            if key in self._entries:
+                self._sizes[key] = size_of(self._entries[key])
+                self._evict(keep=key)
+
+    def _evict(self, keep):
+        while sum(self._sizes.values()) > self.max_bytes and len(self._entries) > 1:
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                self._entries.move_to_end(oldest)
+                oldest = next(iter(self._entries))
+            del self._entries[oldest]
+            del self._sizes[oldest]
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': sum(self._sizes.values()) / 2**20,
+                'max_mb': self.max_bytes / 2**20,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# One cache per server process; modules are imported once, so it outlives script reruns
+CACHE = SharedCache(int(CACHE_MB * 2**20))
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+
+# Declared layout of every input sheet. 'text' columns are kept as labels, 'numeric' columns
+# map to the value that fills blank cells; 'required' columns must be present. Numeric
+# columns come out as contiguous float64, so the costing code never sees object dtypes or NaN.
+SCHEMAS = {
+    'Process_CT': {
+        'required': ['Side', 'Stage', 'Batch Set up Time', 'Process Cycle Time', 'Shift Hr/day', 'Days/Week', 'Weeks/Year'],
+        'text': ['Side', 'Stage'],
+        'numeric': {
+            'Batch Set up Time': 0.0,
+            'Process Cycle Time': 0.0,
+            'CT of each stage': 0.0,
+            'Max Overall PCBA CT': 0.0,
+            'Shift Hr/day': 0.0,
+            'Days/Week': 0.0,
+            'Weeks/Year': 0.0,
+            'Hr/Year (1 Shift)': 0.0,
+            'Overall Labor Efficiency': 0.0,
+            'Total Batch Setup Time, sec': 0.0,
+            'Total Cycle Time, sec': 0.0,
+        },
+    },
+    'NRE': {
+        'required': ['Item', 'Unit Price (₹)', 'Life Cycle (Boards)'],
+        'text': ['Item'],
+        'numeric': {
+            'Unit Price (₹)': 0.0,
+            'Life Cycle (Boards)': 0.0,
+            'Qty for LCV': 0.0,
+            'Extended Price (₹)': 0.0,
+            'Annual Volume': 0.0,
+            'Product Life': 0.0,
+            'Product Volume': 0.0,
+            'Total Cost (₹)': 0.0,
+            '10% tool maintenance (₹)': 0.0,
+            'Extended Price (₹).1': 0.0,
+            'NRE Per Unit (₹)': 0.0,
+        },
+    },
+    'MMR-EMS': {
+        'required': ['Process Name', 'MMR', 'FTE for Batch Set up', 'DL FTE', 'IDL FTE'],
+        'text': ['Machine/Line', 'Process Name', 'Brand'],
+        'numeric': {
+            'MMR': 0.0,
+            'FTE for Batch Set up': 0.0,
+            'DL FTE': 0.0,
+            'IDL FTE': 0.0,
+        },
+    },
+    'Assumptions': {
+        'required': ['Labour cost/Hr', 'Idl Cost/Hr'],
+        'text': [],
+        'numeric': {
+            'Annual Volume': 0.0,
+            'Batch Qty': 0.0,
+            'Test Coverage': 0.0,
+            'Test Efficiency': 0.0,
+            'Labour cost/Hr': 0.0,
+            'Idl Cost/Hr': 0.0,
+            'Overall Labor Efficiency': 0.0,
+        },
+    },
+    'SMD_Package_Feeder_Master': {
+        # Package_Master mixes part numbers and package names and is left as read
+        'required': ['Package_Master', 'Cycle Time_Master'],
+        'text': ['Feeder_Master'],
+        'numeric': {'Cycle Time_Master': 0.0},
+    },
+    'Stage Aliases': {
+        'required': ['Alias', 'Process Name'],
+        'text': ['Alias', 'Process Name'],
+        'numeric': {},
+    },
+}
+
+# The pre-machine-data MMR sheet kept in newer workbooks has the same costing columns
+SCHEMAS['MMR-EMS (original)'] = SCHEMAS['MMR-EMS']
+
+# Every sheet of a process-mapping workbook shares one layout
+PROCESS_MAPPING_SCHEMA = {
+    'required': ['Stage', 'Batch Set up Time', 'Process Cycle Time'],
+    'text': ['Side', 'Stage'],
+    'numeric': {
+        'Batch Set up Time': 0.0,
+        'Process Cycle Time': 0.0,
+        'Max Overall PCBA CT': 0.0,
+        'Shift Hr/day': 0.0,
+        'Days/Week': 0.0,
+        'Weeks/Year': 0.0,
+        'Hr/Year (1 Shift)': 0.0,
+        'Overall Labor Efficiency': 0.0,
+        'Total Batch Setup Time, sec': 0.0,
+        'Total Cycle Time, sec': 0.0,
+        'Bottom Cycle Time': 0.0,
+        'Top Cycle Time': 0.0,
+        'Solder Joints': 0.0,
+        'Component Count': 0.0,
+        'Annual Volume': 0.0,
+    },
+}
+
+ISSUE_COLUMNS = ['Sheet', 'Column', 'Row', 'Value', 'Problem']
+
+
+def coerce(frame, schema, sheet_name):
+    """Check a sheet against its schema and convert its columns in one vectorized pass.
+
+    Returns the converted copy and a list of issues (dicts with ISSUE_COLUMNS); cells
+    that are not numbers are reported and then filled like blank cells.
+    """
+    frame = frame.copy()
+    issues = [
+        {'Sheet': sheet_name, 'Column': column, 'Row': None, 'Value': None, 'Problem': 'missing column'}
+        for column in schema['required']
+        if column not in frame.columns
+    ]
+
+    for column, fill in schema['numeric'].items():
+        if column not in frame.columns:
+            continue
+        values = frame[column]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            numbers = values.astype(np.float64)
+        else:
+            numbers = pd.to_numeric(values, errors='coerce').astype(np.float64)
+            # Excel row numbers: one header row, then 1-based rows
+            bad = numbers.isna() & values.notna()
+            issues.extend(
+                {'Sheet': sheet_name, 'Column': column, 'Row': int(row) + 2, 'Value': str(value), 'Problem': 'not a number'}
+                for row, value in values[bad].items()
+            )
+        frame[column] = np.ascontiguousarray(numbers.fillna(fill).to_numpy())
+
+    for column in schema['text']:
+        if column in frame.columns:
+            # Labels typed as numbers (e.g. a stage called 1) are matched as text
+            frame[column] = frame[column].map(lambda value: value if pd.isna(value) or isinstance(value, str) else str(value))
+    return frame, issues
+
+
+def issue_frame(issues):
+    return pd.DataFrame(issues, columns=ISSUE_COLUMNS)
@@ -0,0 +1,250 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import cost_engine
+import stage_matching
+
+# Feeder slots a feeder of each tape width takes on the placement machine
+FEEDER_SLOTS = {'8mm': 1, '12mm': 2, '16mm': 2, '24mm': 3}
+
+# Feeder_Master classes fed from trays instead of tape feeders
+TRAY_FEEDERS = ['BGA', 'Fine pitch']
+
+# The MMR-EMS process whose Process Cycle Time the estimate replaces
+PLACEMENT_STAGE = 'SMT Placement'
+
+CATALOG_COLUMNS = ['Package_Master', 'Feeder_Master', 'Cycle Time_Master']
+
+# Package is required; without Quantity every line is one placement, without Side every
+# line is on SMT-Top and without Part Number every line is its own part
+BOM_COLUMNS = ['Package']
+LINE_COLUMNS = ['Side', 'Package', 'Quantity', 'Package_Master', 'Feeder_Master', 'Cycle Time_Master', 'Match', 'Placement Time (s)']
+FEEDER_COLUMNS = ['Side', 'Feeder_Master', 'Parts', 'Placements', 'Slots']
+PART_COLUMNS = ['Side', 'Package', 'Feeder_Master', 'Part Number']
+
+# A package found through its family (e.g. 'QFN-32' through the QFN sizes) rather than by name
+FAMILY = 'family'
+
+# Body dimensions ('7.3x4.3x1.9', 'SMD,5.0X3.2'), imperial chip codes ('0402', 'C0603') and
+# named packages ('QFN-28', 'SOT23-5'), each with the number that sizes them
+_BODY = re.compile(r'(?:smd)?ø?(\d+(?:\.\d+)?)x(\d+(?:\.\d+)?)')
+_CHIP = re.compile(r'[a-z]?(\d{4})(?![\d.x])')
+_NAMED = re.compile(r'([a-zø]+)(\d+(?:\.\d+)?)?')
+
+
+def package_key(package):
+    """Lookup key of a package name: Unicode and case folded, 'mm' and pin/lead counts'
+    words dropped, '*' and '×' read as 'x', decimals without trailing zeros, separators
+    removed except between two numbers and chip codes of four digits. Blank packages
+    have no key."""
+    if isinstance(package, (int, np.integer)) or (isinstance(package, float) and package.is_integer()):
+        # Chip sizes read from Excel as numbers lose their leading zero (402 for 0402)
+        return f'{int(package):04d}'
+    if not isinstance(package, str):
+        if pd.isna(package):
+            return None
+        package = str(package)
+    key = unicodedata.normalize('NFKC', package).casefold()
+    key = re.sub(r'[×*]', 'x', key)
+    key = re.sub(r'(?<=\d)\s*(?:mm|pins?|leads?|p)\b', '', key)
+    key = re.sub(r'\d+\.\d+', lambda number: f'{float(number.group()):g}', key)
+    key = re.sub(r'(?<=\d)[\s,_-]+(?=\d)', '-', key)
+    key = re.sub(r'(?<!\d)[\s,_-]+|[\s,_-]+(?!\d)', '', key)
+    if key.isdigit() and len(key) < 4:
+        key = key.zfill(4)
+    return key or None
+
+
+def package_family(key):
+    # (family, size) of a package key, e.g. ('qfn', 28.0), ('chip', 402.0) or ('body', 7.3)
+    body = _BODY.match(key)
+    if body:
+        return 'body', max(float(body.group(1)), float(body.group(2)))
+    chip = _CHIP.match(key)
+    if chip:
+        return 'chip', float(chip.group(1))
+    named = _NAMED.match(key)
+    if named:
+        return named.group(1), float(named.group(2)) if named.group(2) else None
+    return None, None
+
+
+class PackageCatalog:
+    """SMD_Package_Feeder_Master rows indexed by package key, built once per master-data revision.
+
+    A package is looked up by its key; failing that, by its family, taking the member
+    of nearest size (the larger on a tie) or, without a size, the family's own row
+    ('QFN', 'BGA') or else its first. A key listed more than once keeps its first row.
+    Each distinct BOM package is looked up once however many lines carry it.
+    """
+
+    def __init__(self, smd_packages):
+        cost_engine.check_columns(smd_packages, CATALOG_COLUMNS, 'SMD_Package_Feeder_Master')
+        keys = [package_key(package) for package in smd_packages['Package_Master']]
+        rows = [row for row, key in enumerate(keys) if key is not None]
+        self.packages = smd_packages['Package_Master'].to_numpy(dtype=object)[rows]
+        self.feeders = smd_packages['Feeder_Master'].astype(str).to_numpy(dtype=object)[rows]
+        self.cycle_times = pd.to_numeric(smd_packages['Cycle Time_Master'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)[rows]
+
+        self._positions = {}
+        families = {}
+        for position, row in enumerate(rows):
+            key = keys[row]
+            self._positions.setdefault(key, position)
+            family, size = package_family(key)
+            if family is not None:
+                families.setdefault(family, []).append((size, position, key == family))
+
+        # Per family: member sizes in ascending order with their positions, and the row for a bare family name
+        self._families = {}
+        for family, members in families.items():
+            sized = sorted((size, position) for size, position, _ in members if size is not None)
+            default = next((position for _, position, own in members if own), members[0][1])
+            self._families[family] = (
+                np.array([size for size, _ in sized]), np.array([position for _, position in sized], dtype=np.intp), default,
+            )
+
+    def __len__(self):
+        return len(self.packages)
+
+    def nbytes(self):
+        return self.packages.nbytes + self.feeders.nbytes + self.cycle_times.nbytes + 100 * len(self._positions)
+
+    def closest(self, key):
+        # Catalog position of a key's family member of nearest size, or -1
+        family, size = package_family(key)
+        if family not in self._families:
+            return -1
+        sizes, positions, default = self._families[family]
+        if size is None or not len(sizes):
+            return default
+        above = min(int(np.searchsorted(sizes, size)), len(sizes) - 1)
+        below = max(above - 1, 0)
+        return int(positions[below if size - sizes[below] < sizes[above] - size else above])
+
+    def find(self, package):
+        # (catalog position, match kind) of one package
+        key = package_key(package)
+        if key is None:
+            return -1, stage_matching.UNMATCHED
+        if key in self._positions:
+            return self._positions[key], stage_matching.EXACT
+        position = self.closest(key)
+        return position, FAMILY if position >= 0 else stage_matching.UNMATCHED
+
+    def lookup(self, packages):
+        """Catalog position (-1 when unmatched) and match kind of every package, as arrays."""
+        codes, uniques = pd.factorize(pd.Series(packages, dtype=object))
+        unique_positions = np.full(len(uniques), -1, dtype=np.intp)
+        unique_matches = np.full(len(uniques), stage_matching.UNMATCHED, dtype=object)
+        for i, package in enumerate(uniques):
+            unique_positions[i], unique_matches[i] = self.find(package)
+
+        named = codes >= 0
+        positions = np.full(len(codes), -1, dtype=np.intp)
+        matches = np.full(len(codes), stage_matching.UNMATCHED, dtype=object)
+        positions[named] = unique_positions[codes[named]]
+        matches[named] = unique_matches[codes[named]]
+        return positions, matches
+
+
+def placement_side(side):
+    # Process-mapping side of a BOM side: 'Top'/'T' and 'Bottom'/'B', blank taken as top
+    if not isinstance(side, str) or not side.strip():
+        return 'SMT-Top'
+    folded = side.strip().casefold()
+    if folded.startswith('b') or 'bottom' in folded:
+        return 'SMT-Bottom'
+    if folded.startswith('t') or 'top' in folded:
+        return 'SMT-Top'
+    return side.strip()
+
+
+def placement_sides(sides):
+    # placement_side of every value, worked out once per distinct value; blanks factorize to -1, the last entry
+    codes, uniques = pd.factorize(pd.Series(sides, dtype=object))
+    return np.array([placement_side(side) for side in uniques] + ['SMT-Top'], dtype=object)[codes]
+
+
+def bom_lines(bom, catalog, lookup=None):
+    """BOM lines with their catalog package, feeder and placement time.
+
+    ``bom`` needs a Package column; Quantity (placements per board), Side and Part
+    Number are optional. ``lookup`` is the (positions, matches) of catalog.lookup when
+    already known. Unmatched lines keep a blank feeder and no placement time.
+    """
+    cost_engine.check_columns(bom, BOM_COLUMNS, 'BOM')
+    positions, matches = catalog.lookup(bom['Package']) if lookup is None else lookup
+    found = positions >= 0
+    quantity = (
+        pd.to_numeric(bom['Quantity'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        if 'Quantity' in bom.columns else np.ones(len(bom))
+    )
+    sides = placement_sides(bom['Side']) if 'Side' in bom.columns else np.full(len(bom), 'SMT-Top', dtype=object)
+    cycle_times = np.where(found, catalog.cycle_times[positions], np.nan)
+    lines = pd.DataFrame({
+        'Side': sides,
+        'Package': bom['Package'].to_numpy(dtype=object),
+        'Quantity': quantity,
+        'Package_Master': np.where(found, catalog.packages[positions], None),
+        'Feeder_Master': np.where(found, catalog.feeders[positions], None),
+        'Cycle Time_Master': cycle_times,
+        'Match': matches,
+        'Placement Time (s)': np.where(found, quantity * cycle_times, 0.0),
+    }, columns=LINE_COLUMNS)
+    if 'Part Number' in bom.columns:
+        lines['Part Number'] = bom['Part Number'].to_numpy(dtype=object)
+    return lines
+
+
+def part_placements(lines):
+    """Placements and line count of each distinct SMT part of bom_lines, one row per
+    PART_COLUMNS; lines without a Part Number are grouped per package with a blank one.
+
+    Aggregates of several batches of lines can be concatenated and summed again by
+    PART_COLUMNS before feeder_requirements.
+    """
+    matched = lines[lines['Feeder_Master'].notna()]
+    if 'Part Number' not in matched.columns:
+        matched = matched.assign(**{'Part Number': None})
+    return matched.groupby(PART_COLUMNS, sort=False, dropna=False).agg(
+        Placements=('Quantity', 'sum'), Lines=('Quantity', 'size'),
+    ).reset_index()
+
+
+def feeder_requirements(parts):
+    # Distinct parts, placements and slots per side and feeder; each line without a Part Number is a part of its own
+    numbered = parts['Part Number'].notna()
+    distinct = parts[numbered].drop_duplicates(['Side', 'Feeder_Master', 'Part Number']).groupby(['Side', 'Feeder_Master']).size()
+    unnumbered = parts[~numbered].groupby(['Side', 'Feeder_Master'])['Lines'].sum()
+    feeders = parts.groupby(['Side', 'Feeder_Master'], sort=True).agg(Placements=('Placements', 'sum'))
+    feeders['Parts'] = (
+        distinct.reindex(feeders.index, fill_value=0) + unnumbered.reindex(feeders.index, fill_value=0)
+    ).astype(np.int64)
+    feeders = feeders.reset_index()
+    feeders['Slots'] = feeders['Parts'] * feeders['Feeder_Master'].map(FEEDER_SLOTS).fillna(0).astype(np.int64)
+    return feeders[FEEDER_COLUMNS]
+
+
+def apply_placement_times(process_map, side_times):
+    """A copy of a process map with the SMT Placement Process Cycle Time of each side
+    replaced from ``side_times`` ({side: seconds}), split evenly over the side's
+    SMT Placement rows; without a Side column all of them share the total.
+
+    Returns (process map, rows replaced).
+    """
+    stages = process_map.copy()
+    placement = stages['Stage'].map(stage_matching.normalize_key) == stage_matching.normalize_key(PLACEMENT_STAGE)
+    if 'Side' not in stages.columns:
+        side_times = {None: sum(side_times.values())}
+    stages['Process Cycle Time'] = pd.to_numeric(stages['Process Cycle Time'], errors='coerce').astype(np.float64)
+    replaced = 0
+    for side, seconds in side_times.items():
+        rows = placement if side is None else placement & (stages['Side'] == side)
+        if rows.any():
+            stages.loc[rows, 'Process Cycle Time'] = seconds / rows.sum()
+            replaced += int(rows.sum())
+    return stages, replaced
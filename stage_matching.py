@@ -0,0 +1,187 @@
+import html
+import re
+
+import numpy as np
+import pandas as pd
+
+# Approximate matches at least this similar are used, and reported as low confidence
+MATCH_SIMILARITY = 0.8
+
+# Below MATCH_SIMILARITY the closest process name is only suggested, down to this similarity
+SUGGEST_SIMILARITY = 0.4
+
+# Columns of the matching report, one row per stage that did not match exactly
+REPORT_COLUMNS = ['Row', 'Stage', 'Process Name', 'Match', 'Similarity']
+
+# How a stage found its process name; the last two mean it was not matched
+EXACT, NORMALIZED, ALIAS, APPROXIMATE, SUGGESTED, UNMATCHED = (
+    'exact', 'normalized', 'alias', 'approximate', 'suggested', 'unmatched'
+)
+
+
+def normalize_key(name):
+    """Matching key of a stage or process name: HTML entities decoded, case folded and
+    whitespace collapsed, also around '&', '/', '-' and '+'. Blank names have no key."""
+    if not isinstance(name, str):
+        if pd.isna(name):
+            return None
+        name = str(name)
+    key = ' '.join(html.unescape(name).casefold().split())
+    key = re.sub(r' ?([&/+-]) ?', r'\1', key)
+    return key or None
+
+
+def trigrams(key):
+    # Character trigrams of each word, padded like PostgreSQL's pg_trgm
+    return {
+        padded[i:i + 3]
+        for word in key.split(' ')
+        for padded in [f'  {word} ']
+        for i in range(len(padded) - 2)
+    }
+
+
+class StageMatcher:
+    """Process names of a catalog (MMR-EMS), indexed for matching process-map stages.
+
+    Names are normalized once. A stage whose key is not in the catalog is looked up in
+    the alias table, then compared by trigram similarity against an inverted index, so
+    only the process names sharing a trigram with it are scored. Each distinct stage
+    name is matched once however many rows carry it.
+
+    ``codes`` gives the catalog position of every input name (-1 for blanks); names
+    with the same key share a position, ``names`` holds the first spelling of each.
+    """
+
+    def __init__(self, process_names, aliases=None):
+        # Distinct spellings first, then distinct keys; both in order of first appearance
+        spelling_codes, spellings = pd.factorize(pd.Series(process_names))
+        key_codes, key_names = pd.factorize(pd.Series([normalize_key(name) for name in spellings], dtype=object))
+        self.codes = np.full(len(spelling_codes), -1, dtype=np.intp)
+        named = spelling_codes >= 0
+        self.codes[named] = key_codes[spelling_codes[named]]
+
+        first_spellings = {}
+        for spelling, code in zip(spellings, key_codes):
+            if code >= 0:
+                first_spellings.setdefault(code, spelling)
+        self.names = pd.Index([first_spellings[code] for code in range(len(key_names))], dtype=object)
+        self._positions = {key: position for position, key in enumerate(key_names)}
+        self._spellings = set(spellings)
+
+        # Aliases pointing at process names the catalog does not have are kept aside for reporting
+        self.aliases = {}
+        self.unknown_aliases = []
+        for alias, target in (aliases or {}).items():
+            alias_key, target_key = normalize_key(alias), normalize_key(target)
+            if alias_key is None:
+                continue
+            if target_key in self._positions:
+                self.aliases[alias_key] = self._positions[target_key]
+            else:
+                self.unknown_aliases.append(alias)
+
+        # Inverted index: trigram -> catalog positions, with each name's trigram count
+        postings = {}
+        self._trigram_counts = np.zeros(len(key_names), dtype=np.intp)
+        for position, key in enumerate(key_names):
+            grams = trigrams(key)
+            self._trigram_counts[position] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        self._postings = {gram: np.array(positions, dtype=np.intp) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def nbytes(self):
+        return (
+            self.codes.nbytes + self._trigram_counts.nbytes
+            + sum(positions.nbytes + len(gram) for gram, positions in self._postings.items())
+        )
+
+    def closest(self, key):
+        """(catalog position, similarity) of the process name most similar to a key, or (-1, 0.0)."""
+        grams = trigrams(key)
+        hits = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not hits:
+            return -1, 0.0
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        # Jaccard similarity of the trigram sets
+        similarity = shared / (len(grams) + self._trigram_counts - shared)
+        best = int(np.argmax(similarity))
+        return best, float(similarity[best])
+
+    def match(self, stage_names):
+        """Match stage names against the catalog.
+
+        Returns (codes, matches, similarities, candidates) as arrays with one entry per
+        name: the catalog position used (-1 when unmatched), how it matched, the
+        similarity (1.0 unless approximate) and the position of the best candidate,
+        which is also set for suggestions.
+        """
+        name_codes, uniques = pd.factorize(pd.Series(stage_names))
+        unique_candidates = np.full(len(uniques), -1, dtype=np.intp)
+        unique_matches = np.full(len(uniques), UNMATCHED, dtype=object)
+        unique_similarities = np.zeros(len(uniques))
+
+        for i, name in enumerate(uniques):
+            key = normalize_key(name)
+            if key is None:
+                continue
+            if key in self._positions:
+                unique_candidates[i] = self._positions[key]
+                unique_matches[i] = EXACT if name in self._spellings else NORMALIZED
+                unique_similarities[i] = 1.0
+            elif key in self.aliases:
+                unique_candidates[i] = self.aliases[key]
+                unique_matches[i] = ALIAS
+                unique_similarities[i] = 1.0
+            else:
+                candidate, similarity = self.closest(key)
+                if similarity >= MATCH_SIMILARITY:
+                    unique_matches[i] = APPROXIMATE
+                elif similarity >= SUGGEST_SIMILARITY:
+                    unique_matches[i] = SUGGESTED
+                else:
+                    candidate, similarity = -1, 0.0
+                unique_candidates[i] = candidate
+                unique_similarities[i] = similarity
+
+        # Blank names factorize to -1 and stay unmatched
+        named = name_codes >= 0
+        candidates = np.full(len(name_codes), -1, dtype=np.intp)
+        matches = np.full(len(name_codes), UNMATCHED, dtype=object)
+        similarities = np.zeros(len(name_codes))
+        candidates[named] = unique_candidates[name_codes[named]]
+        matches[named] = unique_matches[name_codes[named]]
+        similarities[named] = unique_similarities[name_codes[named]]
+
+        used = np.isin(matches, [EXACT, NORMALIZED, ALIAS, APPROXIMATE])
+        codes = np.where(used, candidates, -1)
+        return codes, matches, similarities, candidates
+
+    def report(self, stage_names):
+        """Stages that did not match exactly, spelled-out or by alias: approximate matches,
+        suggestions and unmatched names, with their Excel row numbers. Blank stages are
+        left out."""
+        stage_names = pd.Series(stage_names).reset_index(drop=True)
+        _, matches, similarities, candidates = self.match(stage_names)
+        named = stage_names.map(normalize_key).notna().to_numpy()
+        flagged = np.flatnonzero(named & ~np.isin(matches, [EXACT, NORMALIZED, ALIAS]))
+        return pd.DataFrame({
+            # One header row, then 1-based rows
+            'Row': flagged + 2,
+            'Stage': stage_names.take(flagged).to_numpy(),
+            'Process Name': [self.names[candidates[row]] if candidates[row] >= 0 else None for row in flagged],
+            'Match': matches[flagged],
+            'Similarity': similarities[flagged],
+        }, columns=REPORT_COLUMNS)
+
+
+def alias_table(aliases):
+    # {alias: process name} from a 'Stage Aliases' sheet; rows without both names are skipped
+    if aliases is None:
+        return {}
+    rows = aliases[['Alias', 'Process Name']].dropna()
+    return dict(zip(rows['Alias'], rows['Process Name']))